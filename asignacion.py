@@ -0,0 +1,141 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from rutas import acumular_desde_hojas
+
+# Capacidad por sentido en personas/min usando todo el ancho de una vía a 40 km/h; los enlaces (*_link) tienen la mitad.
+CAPACIDAD_POR_TIPO_VIA = {
+    'motorway': 1200, 'trunk': 1200, 'primary': 1000, 'secondary': 800, 'tertiary': 600,
+    'unclassified': 400, 'residential': 400, 'busway': 300, 'living_street': 250,
+}
+CAPACIDAD_POR_DEFECTO = 400
+VELOCIDAD_REFERENCIA = 40
+HORIZONTE_MIN = 60
+# Función BPR: t = t0 × (1 + ALFA × (flujo / capacidad) ^ BETA).
+ALFA, BETA = 0.15, 4
+# Tiempo de ingreso a un punto seguro vacío; su exponente BPR es mayor para que la capacidad pese casi como un límite duro.
+TIEMPO_INGRESO_MIN = 10.0
+BETA_PUNTOS = 10
+POBLACION_POR_NODO = 50
+
+
+def capacidad_calles(grafo):
+    tipos = np.char.replace(grafo.tipo_via_calles.astype(str), '_link', '')
+    base = np.array([CAPACIDAD_POR_TIPO_VIA.get(t, CAPACIDAD_POR_DEFECTO) for t in tipos.tolist()], dtype=np.float64)
+    base[np.char.endswith(grafo.tipo_via_calles.astype(str), '_link')] *= 0.5
+    return base * grafo.velocidad_calles / VELOCIDAD_REFERENCIA
+
+
+def bpr(tiempo_libre, flujo, capacidad, beta=BETA):
+    return tiempo_libre * (1 + ALFA * (flujo / capacidad) ** beta)
+
+
+class RedAsignacion:
+    # Grafo aumentado: cada punto seguro es un nodo virtual unido a su nodo de la red
+    # (arista con costo de ingreso) y a un sumidero común (arista de costo cero).
+    def __init__(self, grafo, nodos_seguros, capacidad_puntos):
+        n, m = grafo.num_nodos, grafo.num_aristas
+        nodos_seguros = np.asarray(nodos_seguros, dtype=np.int64)
+        p = len(nodos_seguros)
+        self.grafo, self.n, self.m, self.p = grafo, n, m, p
+        self.sumidero = n + p
+        virtuales = np.arange(n, n + p)
+        origen = np.concatenate([grafo.origenes(), nodos_seguros, virtuales])
+        destino = np.concatenate([grafo.indices, virtuales, np.full(p, self.sumidero)])
+        self.tiempo_libre = np.concatenate([grafo.pesos, np.full(p, TIEMPO_INGRESO_MIN), np.zeros(p)])
+        self.capacidad = np.concatenate([
+            capacidad_calles(grafo)[grafo.calle] * HORIZONTE_MIN,
+            np.asarray(capacidad_puntos, dtype=np.float64),
+            np.full(p, np.inf),
+        ])
+        self.beta = np.concatenate([np.full(m, BETA), np.full(p, BETA_PUNTOS), np.full(p, BETA)])
+        total = n + p + 1
+        self.claves = origen.astype(np.int64) * total + destino
+        self.orden_claves = np.argsort(self.claves)
+        # CSR del grafo invertido: el Dijkstra desde el sumidero da a cada nodo su siguiente paso.
+        self.orden = np.lexsort((origen, destino))
+        indptr = np.zeros(total + 1, dtype=np.int64)
+        np.cumsum(np.bincount(destino, minlength=total), out=indptr[1:])
+        self.indptr, self.indices = indptr, origen[self.orden].astype(np.int32)
+        self.total = total
+
+    def arista(self, u, v):
+        posicion = np.searchsorted(self.claves, u.astype(np.int64) * self.total + v, sorter=self.orden_claves)
+        return self.orden_claves[posicion]
+
+    def todo_o_nada(self, costos, demanda):
+        # Asigna toda la demanda por el árbol de costo mínimo con los costos actuales.
+        matriz = csr_matrix((costos[self.orden], self.indices, self.indptr), shape=(self.total, self.total))
+        _, sucesor = dijkstra(matriz, directed=True, indices=self.sumidero, return_predecessors=True)
+        sucesor = np.where(sucesor >= 0, sucesor, -1)
+        valores = np.zeros(self.total)
+        valores[:self.n] = demanda
+        sin_ruta = (sucesor[:self.n] < 0) & (demanda > 0)
+        valores[:self.n][sin_ruta] = 0
+        subarbol = acumular_desde_hojas(sucesor, valores)
+        con_sucesor = np.flatnonzero(sucesor >= 0)
+        flujo = np.zeros(len(costos))
+        flujo[self.arista(con_sucesor, sucesor[con_sucesor])] = subarbol[con_sucesor]
+        return flujo, float(demanda[sin_ruta].sum())
+
+
+def _paso_optimo(red, flujo, direccion, iteraciones=30):
+    # Bisección sobre la derivada de la función objetivo de Beckmann a lo largo de la dirección.
+    bajo, alto = 0.0, 1.0
+    activas = direccion != 0
+    t0, capacidad, beta = red.tiempo_libre[activas], red.capacidad[activas], red.beta[activas]
+    x, d = flujo[activas], direccion[activas]
+    if np.sum(bpr(t0, x + d, capacidad, beta) * d) <= 0:
+        return 1.0
+    for _ in range(iteraciones):
+        medio = (bajo + alto) / 2
+        if np.sum(bpr(t0, x + medio * d, capacidad, beta) * d) > 0:
+            alto = medio
+        else:
+            bajo = medio
+    return (bajo + alto) / 2
+
+
+class ResultadoAsignacion:
+    def __init__(self, red, flujo, costos, brecha, iteraciones, sin_ruta):
+        self.flujo = flujo[:red.m]
+        self.capacidad = red.capacidad[:red.m]
+        self.saturacion = self.flujo / self.capacidad
+        self.tiempo = costos[:red.m]
+        self.carga_puntos = flujo[red.m:red.m + red.p]
+        self.capacidad_puntos = red.capacidad[red.m:red.m + red.p]
+        self.brecha = brecha
+        self.iteraciones = iteraciones
+        self.poblacion_sin_ruta = sin_ruta
+
+    def a_dataframe_aristas(self, grafo):
+        import pandas as pd
+        return pd.DataFrame({
+            'origen': grafo.ids[grafo.origenes()], 'destino': grafo.ids[grafo.indices],
+            'flujo': self.flujo, 'capacidad': self.capacidad, 'saturacion': self.saturacion, 'tiempo_min': self.tiempo,
+        })
+
+
+def asignar_evacuacion(grafo, nodos_seguros, demanda=None, capacidad_puntos=None, max_iteraciones=100, tolerancia=1e-3):
+    # Asignación de equilibrio (Frank-Wolfe) de toda la población a los puntos seguros.
+    demanda = np.full(grafo.num_nodos, float(POBLACION_POR_NODO)) if demanda is None else np.asarray(demanda, dtype=np.float64)
+    if capacidad_puntos is None:
+        # Sin datos, cada punto seguro puede recibir una parte igual de la población total.
+        capacidad_puntos = np.full(len(nodos_seguros), demanda.sum() / max(len(nodos_seguros), 1))
+    red = RedAsignacion(grafo, nodos_seguros, capacidad_puntos)
+
+    costos = red.tiempo_libre.copy()
+    flujo, sin_ruta = red.todo_o_nada(costos, demanda)
+    brecha, iteracion = np.inf, 0
+    for iteracion in range(1, max_iteraciones + 1):
+        costos = bpr(red.tiempo_libre, flujo, red.capacidad, red.beta)
+        objetivo, _ = red.todo_o_nada(costos, demanda)
+        costo_actual = np.dot(costos, flujo)
+        brecha = (costo_actual - np.dot(costos, objetivo)) / costo_actual if costo_actual > 0 else 0.0
+        if brecha < tolerancia:
+            break
+        direccion = objetivo - flujo
+        flujo = flujo + _paso_optimo(red, flujo, direccion) * direccion
+    costos = bpr(red.tiempo_libre, flujo, red.capacidad, red.beta)
+    return ResultadoAsignacion(red, flujo, costos, brecha, iteracion, sin_ruta)
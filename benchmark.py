@@ -0,0 +1,317 @@
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from grafo import compilar_grafo, guardar_grafo, leer_grafo
+from servicio_datos import RUTA_ARISTAS, RUTA_NODOS, RUTA_PUNTOS
+
+try:
+    import resource
+except ImportError:
+    # Windows: sin getrusage sólo se informa la memoria de Python.
+    resource = None
+
+CONSULTAS = 20
+ENGANCHES = 10_000
+MUESTRAS_CENTRALIDAD = 50
+# Sobre este número de nodos los grafos de NetworkX ocupan varios GB y sus etapas se omiten.
+LIMITE_NETWORKX = 200_000
+TAMANOS_SINTETICOS = (10_000, 100_000, 1_000_000)
+# Separación aproximada entre intersecciones de la grilla sintética y esquina de partida (Lima).
+SEPARACION_M = 100.0
+LAT_INICIO, LON_INICIO = -12.16, -77.06
+NODOS_POR_PUNTO_SEGURO = 2_000
+
+
+def generar_ciudad_sintetica(num_nodos, directorio, semilla=0):
+    # Grilla de calles con el mismo esquema de CSV que los datos reales: avenidas de doble sentido
+    # cada 10 cuadras, calles de un sentido alternado en la mitad de las demás y vulnerabilidad por zonas.
+    rng = np.random.default_rng(semilla)
+    lado = math.ceil(math.sqrt(num_nodos))
+    filas, columnas = np.divmod(np.arange(lado * lado), lado)
+    paso_lat = SEPARACION_M / 111320.0
+    paso_lon = paso_lat / math.cos(math.radians(LAT_INICIO))
+    ruido = rng.normal(0, 0.1, (2, lado * lado))
+    nodos = pd.DataFrame({
+        'id': np.arange(lado * lado, dtype=np.int64) + 1,
+        'lat': LAT_INICIO + (filas + ruido[0]) * paso_lat,
+        'lon': LON_INICIO + (columnas + ruido[1]) * paso_lon,
+    })
+
+    # Vulnerabilidad constante por bloques de 20 × 20 intersecciones, con los mismos valores que el CSV real.
+    bloques = rng.choice([0.1, 0.4, 0.6, 0.8], size=(lado // 20 + 1) ** 2, p=[0.1, 0.2, 0.2, 0.5])
+    indice = np.arange(lado * lado)
+    horizontales = indice[columnas < lado - 1]
+    verticales = indice[filas < lado - 1]
+    origen = np.concatenate([horizontales, verticales])
+    destino = np.concatenate([horizontales + 1, verticales + lado])
+    # Número de la calle (fila para las horizontales, columna para las verticales).
+    linea = np.concatenate([filas[horizontales], columnas[verticales]])
+    avenida = linea % 10 == 0
+    sentido_unico = ~avenida & (linea % 2 == 1)
+    invertir = sentido_unico & (linea % 4 == 3)
+    origen, destino = np.where(invertir, destino, origen), np.where(invertir, origen, destino)
+    dlat = (nodos['lat'].to_numpy()[destino] - nodos['lat'].to_numpy()[origen]) * 111320.0
+    dlon = (nodos['lon'].to_numpy()[destino] - nodos['lon'].to_numpy()[origen]) * 111320.0 * math.cos(math.radians(LAT_INICIO))
+    bloque = (filas[origen] // 20) * (lado // 20 + 1) + columnas[origen] // 20
+    aristas = pd.DataFrame({
+        'origen': origen + 1,
+        'destino': destino + 1,
+        'nombre': np.where(avenida, 'Avenida ', 'Calle ') + linea.astype(str),
+        'longitud': np.hypot(dlat, dlon),
+        'velocidad_max': np.where(avenida, 60, 40),
+        'tipo_via': np.where(avenida, 'primary', 'residential'),
+        'sentido_unico': sentido_unico,
+        'vulnerabilidad': bloques[bloque],
+    })
+    num_puntos = max(1, len(nodos) // NODOS_POR_PUNTO_SEGURO)
+    elegidos = rng.choice(len(nodos), size=num_puntos, replace=False)
+    puntos = pd.DataFrame({
+        'nombre': [f"Punto seguro {i + 1}" for i in range(num_puntos)],
+        'lat': nodos['lat'].to_numpy()[elegidos], 'lon': nodos['lon'].to_numpy()[elegidos],
+    })
+
+    os.makedirs(directorio, exist_ok=True)
+    rutas = tuple(os.path.join(directorio, f"{nombre}_{lado * lado}.csv") for nombre in ("nodos", "calles", "puntos_seguros"))
+    for df, ruta in zip((nodos, aristas, puntos), rutas):
+        df.to_csv(ruta, index=False)
+    return rutas
+
+
+def entorno():
+    import networkx
+    import scipy
+    # git se consulta en el repositorio del benchmark, no en el directorio desde el que se ejecuta.
+    repositorio = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repositorio, capture_output=True, text=True, check=True).stdout.strip()
+        modificado = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repositorio, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, modificado = None, None
+    return {
+        'commit': commit, 'cambios_sin_commit': modificado,
+        'fecha': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(), 'plataforma': platform.platform(), 'procesador': platform.processor(),
+        'cpus': os.cpu_count(),
+        'versiones': {'numpy': np.__version__, 'scipy': scipy.__version__, 'pandas': pd.__version__, 'networkx': networkx.__version__},
+    }
+
+
+def reiniciar_pico_rss():
+    # En Linux, escribir 5 en clear_refs lleva el pico de RSS del proceso a su RSS actual, para que el pico
+    # de una etapa no quede oculto por el de otra anterior. Antes se devuelve al sistema la memoria liberada
+    # que glibc conserva, que si no se reutilizaría sin contar como crecimiento. En otros sistemas el pico sólo crece.
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en bytes en macOS y en KB en Linux.
+    return pico / 2 ** 20 if sys.platform == "darwin" else pico / 2 ** 10
+
+
+def medir(funcion, repeticiones=1, memoria=True):
+    # El tiempo se mide sin tracemalloc (que frena el código Python puro). La primera repetición también
+    # mide el crecimiento del pico de RSS, que incluye lo que reservan scipy y numpy en C; tracemalloc,
+    # en una pasada aparte, sólo ve la memoria reservada por Python.
+    tiempos = []
+    resultado = None
+    rss = None
+    for i in range(repeticiones):
+        gc.collect()
+        if memoria and i == 0:
+            reiniciar_pico_rss()
+            rss = pico_rss_mb()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+        if rss is not None and i == 0:
+            rss = max(pico_rss_mb() - rss, 0.0)
+    medicion = {'tiempo_s': min(tiempos), 'tiempo_mediana_s': statistics.median(tiempos), 'repeticiones': repeticiones}
+    if memoria:
+        if rss is not None:
+            medicion['rss_pico_crecimiento_mb'] = rss
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcion()
+            medicion['memoria_pico_python_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return resultado, medicion
+
+
+def ejecutar_benchmark(nodos_path=RUTA_NODOS, aristas_path=RUTA_ARISTAS, puntos_path=RUTA_PUNTOS, nombre="lima",
+                       consultas=CONSULTAS, repeticiones=3, semilla=0, con_networkx=None, memoria=True, al_progresar=None):
+    import networkx as nx
+    from centralidad import calcular_centralidad
+    from indice_espacial import IndiceEspacial
+    from particiones import GrafoParticionado, construir_particiones
+    from rutas import BuscadorCSR, CampoEvacuacion, cargar_landmarks
+
+    etapas = {}
+
+    def etapa(clave, funcion, repeticiones=repeticiones, **extra):
+        if al_progresar: al_progresar(f"{nombre}: {clave}")
+        resultado, medicion = medir(funcion, repeticiones, memoria)
+        etapas[clave] = dict(medicion, **extra)
+        return resultado
+
+    def omitir(clave, motivo):
+        etapas[clave] = {'omitida': motivo}
+
+    etapa('carga_csv', lambda: (pd.read_csv(nodos_path), pd.read_csv(aristas_path)))
+    grafo = etapa('construccion_grafo', lambda: compilar_grafo(nodos_path, aristas_path))
+    with tempfile.TemporaryDirectory() as temporal:
+        directorio = os.path.join(temporal, "grafo")
+        guardar_grafo(grafo, directorio)
+        etapa('carga_cache', lambda: leer_grafo(directorio).pesos.sum())
+    n = grafo.num_nodos
+    con_networkx = n <= LIMITE_NETWORKX if con_networkx is None else con_networkx
+
+    rng = np.random.default_rng(semilla)
+    indice_espacial = etapa('indice_espacial', lambda: IndiceEspacial(grafo))
+    cajas = (grafo.lat.min(), grafo.lat.max(), grafo.lon.min(), grafo.lon.max())
+    lats, lons = rng.uniform(cajas[0], cajas[1], ENGANCHES), rng.uniform(cajas[2], cajas[3], ENGANCHES)
+    etapa('enganche', lambda: indice_espacial.enganchar(lats, lons), puntos=ENGANCHES)
+
+    df_puntos = pd.read_csv(puntos_path)
+    nodos_seguros = indice_espacial.nodos_cercanos(df_puntos['lat'], df_puntos['lon'])
+    enganche_seguros = indice_espacial.enganchar(df_puntos['lat'], df_puntos['lon'])
+    origenes = rng.choice(n, size=min(consultas, n), replace=False)
+    # Un destino por consulta para comparar los algoritmos en la misma búsqueda de un punto a otro.
+    destinos = rng.choice(nodos_seguros, size=len(origenes))
+    ids, pos_nodos = grafo.ids, grafo.pos_nodos()
+
+    buscador = BuscadorCSR(grafo)
+    campo = etapa('campo_evacuacion', lambda: CampoEvacuacion.desde_enganche(grafo, enganche_seguros))
+    landmarks = etapa('landmarks', lambda: cargar_landmarks(grafo), repeticiones=1)
+    heuristica = etapa('heuristica_alt', lambda: landmarks.para_objetivos(nodos_seguros))
+
+    def csr(heuristicas):
+        def consultar():
+            asentados = 0
+            for origen, destino, heuristica_destino in zip(origenes, destinos, heuristicas):
+                asentados += buscador.buscar(origen, [destino], heuristica_destino)[2]['nodos_asentados']
+            return asentados
+        return consultar
+
+    por_consulta = {'consultas': len(origenes)}
+    asentados = etapa('ruta_unica_dijkstra_csr', csr([None] * len(origenes)), **por_consulta)
+    etapas['ruta_unica_dijkstra_csr']['nodos_asentados'] = asentados
+    # La cota de cada destino (y su paso a lista) es O(n): se mide aparte para que ruta_unica_alt sólo cuente la búsqueda.
+    heuristicas = etapa('heuristica_por_destino', lambda: [landmarks.para_objetivos([destino]).tolist() for destino in destinos], **por_consulta)
+    asentados = etapa('ruta_unica_alt', csr(heuristicas), **por_consulta)
+    etapas['ruta_unica_alt']['nodos_asentados'] = asentados
+
+    asentados = etapa('todos_los_puntos_dijkstra_csr', lambda: sum(buscador.buscar(o, nodos_seguros)[2]['nodos_asentados'] for o in origenes), **por_consulta)
+    etapas['todos_los_puntos_dijkstra_csr']['nodos_asentados'] = asentados
+    heuristica_lista = heuristica.tolist()
+    asentados = etapa('todos_los_puntos_alt', lambda: sum(buscador.buscar(o, nodos_seguros, heuristica_lista)[2]['nodos_asentados'] for o in origenes), **por_consulta)
+    etapas['todos_los_puntos_alt']['nodos_asentados'] = asentados
+    etapa('todos_los_puntos_precalculado', lambda: [campo.ruta(o) for o in origenes], **por_consulta)
+
+    with tempfile.TemporaryDirectory() as temporal:
+        directorio = os.path.join(temporal, "particiones")
+        etapa('construccion_particiones', lambda: construir_particiones(grafo, directorio), repeticiones=1)
+        # Un almacén recién abierto: las celdas se leen del disco a medida que las búsquedas llegan a ellas.
+        particionado = GrafoParticionado(directorio)
+        asentados = etapa('todos_los_puntos_particionado', lambda: sum(particionado.buscar(o, nodos_seguros)[2]['nodos_asentados'] for o in origenes), **por_consulta)
+        etapas['todos_los_puntos_particionado'].update(nodos_asentados=asentados, celdas=particionado.num_celdas,
+                                                        celdas_abiertas=particionado.celdas_abiertas)
+
+    if con_networkx:
+        G_undirected, G_dirigido = etapa('construccion_networkx', grafo.a_networkx, repeticiones=1)
+
+        def heuristica_nx(u, v):
+            # La misma heurística euclidiana en grados que usa la aplicación.
+            return math.dist(pos_nodos[u], pos_nodos[v])
+
+        pares = list(zip(ids[origenes].tolist(), ids[destinos].tolist()))
+        ids_seguros = ids[nodos_seguros].tolist()
+        etapa('ruta_unica_dijkstra_networkx', lambda: [nx.dijkstra_path(G_dirigido, o, d, weight='weight') for o, d in pares], **por_consulta)
+        etapa('ruta_unica_astar_networkx', lambda: [nx.astar_path(G_dirigido, o, d, heuristic=heuristica_nx, weight='weight') for o, d in pares], **por_consulta)
+
+        def todos_dijkstra_nx():
+            for origen, _ in pares:
+                nx.single_source_dijkstra_path_length(G_dirigido, origen, weight='weight')
+
+        def todos_astar_nx():
+            # Un A* por punto seguro, como el modo A* de la aplicación.
+            for origen, _ in pares:
+                for destino in ids_seguros:
+                    try:
+                        nx.astar_path_length(G_dirigido, origen, destino, heuristic=heuristica_nx, weight='weight')
+                    except nx.NetworkXNoPath:
+                        pass
+
+        etapa('todos_los_puntos_dijkstra_networkx', todos_dijkstra_nx, **por_consulta)
+        etapa('todos_los_puntos_astar_networkx', todos_astar_nx, **por_consulta, puntos_seguros=len(ids_seguros))
+        muestras = min(MUESTRAS_CENTRALIDAD, n)
+        etapa('centralidad_networkx', lambda: nx.betweenness_centrality(G_undirected, k=muestras, weight='weight', seed=semilla),
+              repeticiones=1, muestras=muestras)
+    else:
+        motivo = f"más de {LIMITE_NETWORKX} nodos" if n > LIMITE_NETWORKX else "desactivado"
+        for clave in ('construccion_networkx', 'ruta_unica_dijkstra_networkx', 'ruta_unica_astar_networkx',
+                      'todos_los_puntos_dijkstra_networkx', 'todos_los_puntos_astar_networkx', 'centralidad_networkx'):
+            omitir(clave, motivo)
+
+    muestras = min(MUESTRAS_CENTRALIDAD, n)
+    etapa('centralidad_csr', lambda: calcular_centralidad(grafo, k=muestras, semilla=semilla, procesos=1),
+          repeticiones=1, muestras=muestras)
+
+    for medicion in etapas.values():
+        if 'consultas' in medicion:
+            medicion['tiempo_por_consulta_ms'] = medicion['tiempo_s'] / medicion['consultas'] * 1000
+    return {
+        'nombre': nombre,
+        'grafo': {'nodos': n, 'aristas': grafo.num_aristas, 'calles': grafo.num_calles, 'puntos_seguros': len(nodos_seguros)},
+        'etapas': etapas,
+    }
+
+
+def ejecutar_suite(salida_path, tamanos_sinteticos=(), incluir_lima=True, directorio_sintetico=None, semilla=0,
+                   al_progresar=None, **opciones):
+    resultado = {'entorno': entorno(), 'grafos': []}
+
+    def guardar():
+        # Se reescribe tras cada grafo para no perder lo medido si una ejecución grande se interrumpe.
+        with open(salida_path, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+    if incluir_lima:
+        resultado['grafos'].append(ejecutar_benchmark(semilla=semilla, al_progresar=al_progresar, **opciones))
+        guardar()
+    with tempfile.TemporaryDirectory() as temporal:
+        for tamano in tamanos_sinteticos:
+            if al_progresar: al_progresar(f"Generando grilla sintética de {tamano} nodos...")
+            rutas = generar_ciudad_sintetica(tamano, directorio_sintetico or temporal, semilla)
+            resultado['grafos'].append(ejecutar_benchmark(*rutas, nombre=f"sintetico_{tamano}", semilla=semilla,
+                                                          al_progresar=al_progresar, **opciones))
+            guardar()
+    guardar()
+    return resultado
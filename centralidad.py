@@ -0,0 +1,89 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from grafo import arreglos_en_cache, leer_grafo
+from rutas import acumular_desde_hojas, matriz_no_dirigida
+
+MUESTRAS = 200
+TOP = 50
+_grafo = None
+
+
+def dependencias(grafo, fuentes):
+    # Brandes con un único árbol de caminos mínimos por fuente: la dependencia de un nodo
+    # es su número de descendientes en el árbol. Los empates exactos de costo se resuelven
+    # con el predecesor que elige Dijkstra.
+    n = grafo.num_nodos
+    fuentes = np.asarray(fuentes, dtype=np.int64)
+    _, predecesor = dijkstra(matriz_no_dirigida(grafo), directed=False, indices=fuentes, return_predecessors=True)
+    # Los árboles de todas las fuentes del lote se procesan juntos en un arreglo aplanado.
+    desplazamiento = (np.arange(len(fuentes), dtype=np.int64) * n)[:, None]
+    padre = np.where(predecesor >= 0, predecesor + desplazamiento, -1).ravel()
+    tamano = acumular_desde_hojas(padre, padre >= 0)
+    # tamano cuenta al propio nodo; la dependencia son sólo sus descendientes.
+    dependencia = np.where(padre >= 0, tamano - 1, 0.0)
+    return dependencia.reshape(len(fuentes), n).sum(axis=0)
+
+
+def _inicializar_trabajador(directorio, clave):
+    global _grafo
+    _grafo = leer_grafo(directorio, clave)
+
+
+def _dependencias_lote(fuentes):
+    return dependencias(_grafo, fuentes)
+
+
+def elegir_fuentes(grafo, k=MUESTRAS, semilla=0):
+    if k is None or k >= grafo.num_nodos:
+        return np.arange(grafo.num_nodos)
+    return np.random.default_rng(semilla).choice(grafo.num_nodos, size=k, replace=False)
+
+
+def escala(n, k=None):
+    # Misma normalización que nx.betweenness_centrality(normalized=True) para grafos no dirigidos.
+    if n <= 2:
+        return 1.0
+    factor = 1 / ((n - 1) * (n - 2))
+    return factor * n / k if k else factor
+
+
+def calcular_centralidad(grafo, k=MUESTRAS, semilla=0, exacta=False, procesos=None, al_progresar=None, top=TOP):
+    k = None if exacta else k
+
+    def calcular():
+        fuentes = elegir_fuentes(grafo, k, semilla)
+        n_procesos = procesos or os.cpu_count() or 1
+        tamano_lote = max(1, min(25, math.ceil(len(fuentes) / (4 * n_procesos))))
+        lotes = [fuentes[i:i + tamano_lote] for i in range(0, len(fuentes), tamano_lote)]
+        suma = np.zeros(grafo.num_nodos)
+        completadas = 0
+
+        def acumular(parcial, cantidad):
+            nonlocal completadas
+            suma[:] += parcial
+            completadas += cantidad
+            if al_progresar and completadas < len(fuentes):
+                al_progresar(np.argsort(-suma)[:top], completadas, len(fuentes))
+
+        if n_procesos == 1 or grafo.directorio is None:
+            for lote in lotes:
+                acumular(dependencias(grafo, lote), len(lote))
+        else:
+            with ProcessPoolExecutor(max_workers=n_procesos, initializer=_inicializar_trabajador,
+                                     initargs=(grafo.directorio, grafo.clave)) as pool:
+                futuros = {pool.submit(_dependencias_lote, lote): len(lote) for lote in lotes}
+                for futuro in as_completed(futuros):
+                    acumular(futuro.result(), futuros[futuro])
+        return {'centralidad': suma * escala(grafo.num_nodos, k)}
+
+    nombre = "centralidad_exacta" if k is None else f"centralidad_k{k}_s{semilla}"
+    return arreglos_en_cache(grafo, nombre, calcular)['centralidad']
+
+
+def nodos_criticos(centralidad, top=TOP):
+    return np.argsort(-centralidad)[:top]
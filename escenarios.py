@@ -0,0 +1,194 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from grafo import leer_grafo
+from rutas import CampoEvacuacion, acumular_hacia_destino
+
+INTENSIDAD = 0.1
+ESCENARIOS_POR_LOTE = 50
+NUM_INTERVALOS = 32
+_reparador = None
+# Cómo se combinan los acumulados de dos lotes: aislados, suma, suma de cuadrados, histograma, mínimo y máximo.
+_COMBINAR = (np.add, np.add, np.add, np.add, np.minimum, np.maximum)
+
+
+def probabilidad_cierre(vulnerabilidad, intensidad=INTENSIDAD):
+    # Probabilidad de que una calle quede intransitable: proporcional a su vulnerabilidad.
+    return np.clip(np.asarray(vulnerabilidad) * intensidad, 0.0, 1.0)
+
+
+def muestrear_cierres(rng, grafo, cantidad, intensidad=INTENSIDAD):
+    # Un escenario a la vez, como máscara por arista dirigida; ambos sentidos de una calle se cierran juntos.
+    # Sortear fila por fila consume el generador en el mismo orden que una matriz de `cantidad` filas.
+    probabilidad = probabilidad_cierre(grafo.vulnerabilidad_calles, intensidad)
+    for _ in range(cantidad):
+        yield (rng.random(grafo.num_calles) < probabilidad)[grafo.calle]
+
+
+class ReparadorArbol:
+    # Repara el árbol de evacuación cuando se cierran aristas: sólo se recalculan
+    # los nodos cuya ruta original pasaba por una arista cerrada.
+    def __init__(self, grafo, nodos_seguros):
+        self.grafo = grafo
+        self.campo = CampoEvacuacion(grafo, nodos_seguros)
+        con_sucesor = np.flatnonzero(self.campo.sucesor >= 0)
+        self.arista_arbol = np.full(grafo.num_nodos, -1, dtype=np.int64)
+        self.arista_arbol[con_sucesor] = grafo.indice_arista(con_sucesor, self.campo.sucesor[con_sucesor])
+
+    def reparar(self, cerrada):
+        grafo, campo = self.grafo, self.campo
+        costo = campo.costo.copy()
+        sucesor = campo.sucesor.copy()
+        rotos = np.zeros(grafo.num_nodos, dtype=bool)
+        con_arista = self.arista_arbol >= 0
+        rotos[con_arista] = cerrada[self.arista_arbol[con_arista]]
+        afectados = np.flatnonzero(acumular_hacia_destino(campo.sucesor, rotos) > 0)
+        if len(afectados) == 0:
+            return costo, sucesor
+        es_afectado = np.zeros(grafo.num_nodos, dtype=bool)
+        es_afectado[afectados] = True
+
+        # Costo inicial de cada nodo afectado: la mejor arista abierta hacia un nodo que conserva su ruta.
+        inicio, fin = grafo.indptr[afectados], grafo.indptr[afectados + 1]
+        cantidad = fin - inicio
+        aristas = np.repeat(inicio - np.cumsum(cantidad) + cantidad, cantidad) + np.arange(cantidad.sum())
+        origen = np.repeat(afectados, cantidad)
+        destino = grafo.indices[aristas]
+        abiertas = ~cerrada[aristas]
+        candidato = np.where(abiertas & ~es_afectado[destino], grafo.pesos[aristas] + costo[destino], np.inf)
+        orden = np.lexsort((candidato, origen))
+        primero = orden[np.r_[True, origen[orden][1:] != origen[orden][:-1]]]
+        mejores = primero[np.isfinite(candidato[primero])]
+
+        # Dijkstra restringido a los nodos afectados sobre el subgrafo invertido, con un nodo
+        # virtual (índice k) unido a cada afectado por su costo inicial.
+        k = len(afectados)
+        local = np.full(grafo.num_nodos, -1, dtype=np.int64)
+        local[afectados] = np.arange(k)
+        internas = abiertas & es_afectado[destino]
+        matriz = csr_matrix((
+            np.concatenate([candidato[mejores], grafo.pesos[aristas[internas]]]),
+            (np.concatenate([np.full(len(mejores), k), local[destino[internas]]]),
+             np.concatenate([local[origen[mejores]], local[origen[internas]]])),
+        ), shape=(k + 1, k + 1))
+        distancias, predecesor = dijkstra(matriz, directed=True, indices=k, return_predecessors=True)
+        sucesor_frontera = np.full(k, -1, dtype=np.int64)
+        sucesor_frontera[local[origen[mejores]]] = destino[mejores]
+        predecesor = predecesor[:k]
+        costo[afectados] = distancias[:k]
+        interno = np.clip(predecesor, 0, k - 1)
+        sucesor[afectados] = np.where(predecesor == k, sucesor_frontera, np.where(predecesor >= 0, afectados[interno], -1))
+        return costo, sucesor
+
+
+class ResultadoEscenarios:
+    def __init__(self, num_escenarios, aislados, suma, suma_cuadrados, histograma, minimo, maximo, bordes):
+        self.num_escenarios = num_escenarios
+        self.histograma = histograma
+        self.bordes = bordes
+        self.minimo, self.maximo = minimo, maximo
+        self.prob_aislado = aislados / num_escenarios
+        alcanzados = num_escenarios - aislados
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.costo_medio = suma / alcanzados
+            self.costo_std = np.sqrt(np.maximum(suma_cuadrados / alcanzados - self.costo_medio ** 2, 0.0))
+
+    def percentil(self, q):
+        # Interpolado dentro del intervalo del histograma que acumula la fracción q y acotado al mínimo
+        # y máximo observados en cada nodo; el último intervalo, abierto, termina en el máximo.
+        acumulado = np.cumsum(self.histograma, axis=1)
+        total = acumulado[:, -1]
+        objetivo = q * total
+        ultimo = len(self.bordes) - 1
+        intervalo = np.minimum((acumulado < objetivo[:, None]).sum(axis=1), ultimo)
+        filas = np.arange(len(total))
+        antes = np.where(intervalo > 0, acumulado[filas, intervalo - 1], 0)
+        inferior = self.bordes[intervalo]
+        superior = np.where(intervalo < ultimo, self.bordes[np.minimum(intervalo + 1, ultimo)], self.maximo)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraccion = np.nan_to_num(np.clip((objetivo - antes) / self.histograma[filas, intervalo], 0.0, 1.0))
+            valores = np.clip(inferior + fraccion * (superior - inferior), self.minimo, self.maximo)
+        return np.where(total > 0, valores, np.nan)
+
+    def a_dataframe(self, grafo):
+        import pandas as pd
+        return pd.DataFrame({
+            'id': grafo.ids, 'lat': grafo.lat, 'lon': grafo.lon,
+            'prob_aislado': self.prob_aislado,
+            'costo_medio': self.costo_medio, 'costo_std': self.costo_std,
+            'costo_p50': self.percentil(0.5), 'costo_p90': self.percentil(0.9),
+        })
+
+
+def simular_lote(reparador, semilla, cantidad, intensidad, bordes):
+    grafo = reparador.grafo
+    n, num_intervalos = grafo.num_nodos, len(bordes)
+    aislados = np.zeros(n, dtype=np.int64)
+    suma = np.zeros(n)
+    suma_cuadrados = np.zeros(n)
+    histograma = np.zeros(n * num_intervalos, dtype=np.int64)
+    minimo = np.full(n, np.inf)
+    maximo = np.full(n, -np.inf)
+    base = np.arange(n, dtype=np.int64) * num_intervalos
+    rng = np.random.default_rng(semilla)
+    for cerrada in muestrear_cierres(rng, grafo, cantidad, intensidad):
+        costo, _ = reparador.reparar(cerrada)
+        finito = np.isfinite(costo)
+        aislados += ~finito
+        valores = np.where(finito, costo, 0.0)
+        suma += valores
+        suma_cuadrados += valores ** 2
+        np.minimum(minimo, np.where(finito, costo, np.inf), out=minimo)
+        np.maximum(maximo, np.where(finito, costo, -np.inf), out=maximo)
+        # El último intervalo acumula todo lo que supera el último borde.
+        intervalo = np.searchsorted(bordes, valores[finito], side='right') - 1
+        histograma += np.bincount(base[finito] + intervalo, minlength=n * num_intervalos)
+    return aislados, suma, suma_cuadrados, histograma.reshape(n, num_intervalos), minimo, maximo
+
+
+def _inicializar_trabajador(directorio, clave, nodos_seguros):
+    global _reparador
+    _reparador = ReparadorArbol(leer_grafo(directorio, clave), nodos_seguros)
+
+
+def _simular_lote(semilla, cantidad, intensidad, bordes):
+    return simular_lote(_reparador, semilla, cantidad, intensidad, bordes)
+
+
+def simular_escenarios(grafo, nodos_seguros, num_escenarios=1000, intensidad=INTENSIDAD, semilla=0,
+                       procesos=None, num_intervalos=NUM_INTERVALOS, al_progresar=None):
+    if num_escenarios < 1:
+        raise ValueError("Se necesita al menos un escenario.")
+    reparador = ReparadorArbol(grafo, nodos_seguros)
+    costo_base = reparador.campo.costo[np.isfinite(reparador.campo.costo)]
+    maximo = 3 * costo_base.max() if len(costo_base) else 1.0
+    bordes = np.linspace(0.0, maximo, num_intervalos)
+
+    cantidades = [min(ESCENARIOS_POR_LOTE, num_escenarios - i) for i in range(0, num_escenarios, ESCENARIOS_POR_LOTE)]
+    # Una semilla independiente por lote: el resultado no depende del número de procesos.
+    semillas = np.random.SeedSequence(semilla).spawn(len(cantidades))
+    totales = None
+    completados = 0
+
+    def acumular(parcial, cantidad):
+        nonlocal totales, completados
+        totales = parcial if totales is None else tuple(f(a, b) for f, a, b in zip(_COMBINAR, totales, parcial))
+        completados += cantidad
+        if al_progresar:
+            al_progresar(completados, num_escenarios)
+
+    procesos = procesos or os.cpu_count() or 1
+    if procesos == 1 or grafo.directorio is None:
+        for semilla_lote, cantidad in zip(semillas, cantidades):
+            acumular(simular_lote(reparador, semilla_lote, cantidad, intensidad, bordes), cantidad)
+    else:
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_trabajador,
+                                 initargs=(grafo.directorio, grafo.clave, np.asarray(nodos_seguros))) as pool:
+            futuros = {pool.submit(_simular_lote, s, c, intensidad, bordes): c for s, c in zip(semillas, cantidades)}
+            for futuro in as_completed(futuros):
+                acumular(futuro.result(), futuros[futuro])
+    return ResultadoEscenarios(num_escenarios, *totales, bordes)
@@ -1,15 +1,15 @@
 import tkinter
 from tkinter import ttk, messagebox
-import tkintermapview
-import pandas as pd
-import networkx as nx
-from scipy.spatial import KDTree
-import os
 import threading
-from queue import Queue, Empty
 import math
-import geojson
 import time
+import argparse
+import multiprocessing
+from servicio_datos import DIRECTORIO_CACHE, RUTA_PUNTOS, obtener_servicio
+from planificador import ColaTk, PlanificadorRutas
+import trazas
+# pandas, networkx, numpy, scipy y tkintermapview se importan donde se usan,
+# para que el menú aparezca sin esperarlos; el precalentamiento del servicio los carga en segundo plano.
 
 class MapViewFrame(tkinter.Frame):
     def __init__(self, master, app_controller, algorithm_choice: str):
@@ -19,124 +19,151 @@ class MapViewFrame(tkinter.Frame):
         self.algorithm_info = {
             "dijkstra": {"name": "Dijkstra", "color": "#E63946", "type": "route"},
             "astar": {"name": "A*", "color": "#E63946", "type": "route"},
-            "centrality": {"name": "Análisis de Puntos Críticos", "color": "#E63946", "type": "network_analysis"}
+            "alt": {"name": "A* con Landmarks (ALT)", "color": "#E63946", "type": "route"},
+            "precalculado": {"name": "Dijkstra Multi-Origen (Precalculado)", "color": "#E63946", "type": "route"},
+            "particionado": {"name": "Dijkstra sobre Grafo Particionado", "color": "#E63946", "type": "route"},
+            "centrality": {"name": "Análisis de Puntos Críticos", "color": "#E63946", "type": "network_analysis"},
+            "asignacion": {"name": "Evacuación Masiva con Capacidades", "color": "#E63946", "type": "network_analysis"}
         }
         self.configure(bg="#ECECEC")
+        import tkintermapview
         
         top_frame = ttk.Frame(self, padding="5 5 5 5")
         top_frame.pack(fill="x")
         back_button = ttk.Button(top_frame, text="◄ Volver al Menú", command=self.app.show_menu, style="Accent.TButton")
         back_button.pack(side="left", padx=5)
         algo_name = self.algorithm_info[self.algorithm_choice]["name"]
+        ttk.Button(top_frame, text="📊 Diagnóstico", command=self.abrir_diagnostico, style="Secondary.TButton").pack(side="right", padx=5)
         self.status_label = ttk.Label(top_frame, text=f"Algoritmo: {algo_name}. Cargando datos...", font=("Helvetica", 11), anchor="w")
         self.status_label.pack(side="left", padx=10, expand=True, fill="x")
         self.map_widget = tkintermapview.TkinterMapView(self, width=980, height=720, corner_radius=0)
         self.map_widget.pack(fill="both", expand=True, padx=10, pady=(0, 10))
         
-        self.G_undirected, self.G_dirigido, self.pos_nodos, self.kd_tree_nodos, self.df_nodos = None, None, None, None, None
+        self.G_undirected, self.G_dirigido, self.pos_nodos, self.indice_espacial, self.grafo = None, None, None, None, None
         self.puntos_seguros_data = []
+        self.campo_evacuacion, self.grafo_particionado = None, None
+        self.buscador_csr, self.heuristica_alt, self.nodos_seguros, self.enganche_seguros = None, None, None, None
+        self.objetivos_seguros = None
         self.puntos_seguros_markers = {}
+        self.capa_limites, self.nivel_limites, self.limites_dibujados = None, None, []
+        self.aviso_limites, self.after_zoom = "", None
         self.origen_marker, self.destino_marker = None, None
         self.drawn_elements = []
         self.last_destination_info = None
-        self.gui_queue = Queue()
-        
-        self.process_gui_queue()
+        self.planificador = None
+        self.panel_diagnostico = None
+        # Las tareas para Tk llegan por evento virtual; <Map> recoge las que se encolaron antes de mostrar el frame.
+        self.gui_queue = ColaTk(self)
+        self.bind(ColaTk.EVENTO, self.process_gui_queue)
+        self.bind("<Map>", self.process_gui_queue)
         threading.Thread(target=self.cargar_datos_iniciales, daemon=True).start()
 
-    def process_gui_queue(self):
-        try:
-            while not self.gui_queue.empty():
-                task, args = self.gui_queue.get_nowait()
-                task(*args)
-        except Empty: pass
-        finally: self.after(100, self.process_gui_queue)
-
-    def dibujar_limites_distritales_geojson(self):
-        distritos_de_interes = ["SAN ISIDRO", "MIRAFLORES", "SURQUILLO", "SAN BORJA", "BARRANCO", "SANTIAGO DE SURCO"]
-        geojson_path = "peru_distrital_simple.geojson"
-        if not os.path.exists(geojson_path):
-            self.set_status_text(f"Advertencia: No se encontró '{geojson_path}'.")
+    def process_gui_queue(self, event=None):
+        self.gui_queue.vaciar()
+
+    def entregar(self, solicitud, task, *args):
+        # Los resultados de un clic que ya fue reemplazado no llegan a la interfaz.
+        self.gui_queue.put((self._entregar_si_vigente, (solicitud, task, args)))
+
+    def _entregar_si_vigente(self, solicitud, task, args):
+        if solicitud.vigente:
+            task(*args)
+        elif task == self.dibujar_ruta:
+            # La ruta se calculó pero ya no se dibuja; su traza queda registrada como descartada.
+            solicitud.traza.terminar(descartada=True)
+
+    def destroy(self):
+        if self.planificador: self.planificador.detener()
+        if self.after_zoom: self.after_cancel(self.after_zoom)
+        super().destroy()
+
+    def abrir_diagnostico(self):
+        if self.panel_diagnostico is not None and self.panel_diagnostico.winfo_exists():
+            self.panel_diagnostico.lift()
             return
-        try:
-            with open(geojson_path, "r", encoding="utf-8") as f:
-                geojson_data = geojson.load(f)
-            for feature in geojson_data['features']:
-                properties = feature.get('properties', {})
-                if properties.get('NOMBPROV', '').upper() == 'LIMA' and properties.get('NOMBDIST', '').upper() in distritos_de_interes:
-                    geometria = feature.get('geometry')
-                    if not geometria: continue
-                    geometries = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria.get('coordinates', [])
-                    for geometry_coords in geometries:
-                        coordenadas_exteriores = geometry_coords[0]
-                        if len(coordenadas_exteriores) > 1:
-                            coordenadas_corregidas = [(c[1], c[0]) for c in coordenadas_exteriores]
-                            self.map_widget.set_path(coordenadas_corregidas, color="#0004FF", width=1)
-        except Exception as e:
-            self.set_status_text(f"Error al leer archivo de límites: {e}")
+        self.panel_diagnostico = PanelDiagnostico(self)
 
-    def cargar_datos_iniciales(self):
-        try:
-            self.set_status_text("Cargando y procesando datos...")
-            nodos_path = "nodos_lima.csv"
-            aristas_path = "calles_lima_con_vulnerabilidad.csv"
-            puntos_path = "puntos_seguros.csv"
-            
-            df_nodos_full = pd.read_csv(nodos_path)
-            df_nodos_full.dropna(subset=['lat', 'lon'], inplace=True)
-            df_aristas = pd.read_csv(aristas_path)
-            df_puntos_seguros = pd.read_csv(puntos_path)
-            
-            G_full_undirected = nx.Graph()
-            G_full_directed = nx.DiGraph()
-
-            for _, arista in df_aristas.iterrows():
-                velocidad_kmh = arista.get('velocidad_max', 30)
-                if not isinstance(velocidad_kmh, (int, float)) or velocidad_kmh <= 0:
-                    velocidad_kmh = 30
-                distancia_km = arista['longitud'] / 1000
-                tiempo_en_minutos = (distancia_km / velocidad_kmh) * 60
-                penalizacion_riesgo = 1 + (arista.get('vulnerabilidad', 0) * 2.0)
-                peso = tiempo_en_minutos * penalizacion_riesgo
-                
-                origen, destino = arista['origen'], arista['destino']
-                G_full_undirected.add_edge(origen, destino, weight=peso)
-                G_full_directed.add_edge(origen, destino, weight=peso)
-                if not arista.get('sentido_unico', False):
-                    G_full_directed.add_edge(destino, origen, weight=peso)
+    def dibujar_limites_distritales(self):
+        # Dibuja el nivel de detalle que corresponde al zoom actual; sólo redibuja si el nivel cambia.
+        if self.capa_limites is None:
+            return
+        nivel = self.capa_limites.nivel(self.map_widget.zoom)
+        if nivel == self.nivel_limites:
+            return
+        for path in self.limites_dibujados:
+            path.delete()
+        self.limites_dibujados = [self.map_widget.set_path(anillo, color="#0004FF", width=1) for anillo in self.capa_limites.anillos(nivel)]
+        self.nivel_limites = nivel
 
-            main_component_nodes = max(nx.connected_components(G_full_undirected), key=len)
-            
-            self.G_undirected = G_full_undirected.subgraph(main_component_nodes).copy()
-            self.G_dirigido = G_full_directed.subgraph(main_component_nodes).copy()
+    def vigilar_zoom(self):
+        # tkintermapview no avisa cuando cambia el zoom, así que se consulta periódicamente.
+        self.dibujar_limites_distritales()
+        self.after_zoom = self.after(300, self.vigilar_zoom)
 
-            self.df_nodos = df_nodos_full[df_nodos_full['id'].isin(main_component_nodes)]
-            self.kd_tree_nodos = KDTree(self.df_nodos[['lat', 'lon']].values)
-            self.pos_nodos = {n['id']: (n['lat'], n['lon']) for _, n in self.df_nodos.iterrows()}
-            self.puntos_seguros_data = [p.to_dict() for _, p in df_puntos_seguros.iterrows() if self.encontrar_nodo_cercano(p["lat"], p["lon"]) in self.G_undirected]
+    def cargar_datos_iniciales(self):
+        try:
+            # Todo sale del servicio del proceso: si el precalentamiento ya terminó no se recalcula nada,
+            # y si sigue en curso esta vista espera a las mismas estructuras en lugar de construir otras.
+            servicio = self.app.servicio
+            if self.algorithm_choice == "particionado":
+                # Sólo el overlay y las celdas que se usen: ni el grafo completo, ni el índice espacial, ni pos_nodos.
+                if not servicio.cargado('objetivos_particionados'):
+                    self.set_status_text("Abriendo el grafo particionado...")
+                self.grafo_particionado = servicio.grafo_particionado
+                self.puntos_seguros_data = servicio.registros_puntos
+                costo_final, punto_de_nodo, self.enganche_seguros = servicio.objetivos_particionados
+                self.objetivos_seguros = (costo_final, punto_de_nodo)
+            else:
+                if not servicio.cargado('campo_evacuacion'):
+                    self.set_status_text("Cargando y procesando datos...")
+                self.grafo = servicio.grafo
+                self.indice_espacial = servicio.indice_espacial
+                self.pos_nodos = servicio.pos_nodos
+                self.puntos_seguros_data = servicio.puntos_seguros
+                self.nodos_seguros = servicio.nodos_seguros
+                self.enganche_seguros = servicio.enganche_seguros
+            # Sin límites distritales el mapa sigue siendo usable: sólo se avisa en la barra de estado.
+            try:
+                self.capa_limites = servicio.limites
+                if self.capa_limites is None:
+                    from limites import RUTA_GEOJSON
+                    self.aviso_limites = f" Advertencia: No se encontró '{RUTA_GEOJSON}'."
+            except Exception as e:
+                self.aviso_limites = f" Error al leer archivo de límites: {e}"
+            if self.algorithm_info[self.algorithm_choice]['type'] == 'route' and self.objetivos_seguros is None:
+                self.objetivos_seguros = servicio.objetivos_seguros
+            if self.algorithm_choice in ("dijkstra", "astar"):
+                self.G_undirected, self.G_dirigido = servicio.grafos_networkx
+            elif self.algorithm_choice == "precalculado":
+                self.campo_evacuacion = servicio.campo_evacuacion
+            elif self.algorithm_choice == "alt":
+                self.buscador_csr = servicio.buscador_csr
+                self.heuristica_alt = servicio.heuristica_alt
             
             self.gui_queue.put((self.setup_map, ()))
         except Exception as e:
             self.gui_queue.put((self.set_status_text, (f"Error fatal al cargar datos: {e}",)))
 
     def setup_map(self):
-        self.dibujar_limites_distritales_geojson()
         for punto in self.puntos_seguros_data:
             marker = self.map_widget.set_marker(punto["lat"], punto["lon"], text=punto["nombre"], text_color="#2E603A", marker_color_circle="#588157", marker_color_outside="#2E603A")
             self.puntos_seguros_markers[(punto["lat"], punto["lon"])] = marker
         
         self.map_widget.set_position(-12.119, -77.021)
         self.map_widget.set_zoom(14)
+        self.vigilar_zoom()
         
         algo_type = self.algorithm_info[self.algorithm_choice]['type']
         algo_name = self.algorithm_info[self.algorithm_choice]['name']
         
         if algo_type == 'route':
+            self.planificador = PlanificadorRutas(self.encontrar_y_dibujar_ruta)
             self.map_widget.add_left_click_map_command(self.on_map_click_route)
-            self.set_status_text(f"Algoritmo: {algo_name}. Haz clic para elegir tu ubicación.")
+            self.set_status_text(f"Algoritmo: {algo_name}. Haz clic para elegir tu ubicación.{self.aviso_limites}")
         elif algo_type == 'network_analysis':
-            self.set_status_text(f"Calculando {algo_name}... Esto puede tardar unos segundos.")
-            threading.Thread(target=self.calcular_y_dibujar_puntos_criticos, daemon=True).start()
+            self.set_status_text(f"Calculando {algo_name}... Esto puede tardar unos segundos.{self.aviso_limites}")
+            tarea = self.calcular_y_dibujar_asignacion if self.algorithm_choice == "asignacion" else self.calcular_y_dibujar_puntos_criticos
+            threading.Thread(target=tarea, daemon=True).start()
 
     def set_status_text(self, text):
         self.status_label.config(text=text)
@@ -162,90 +189,265 @@ class MapViewFrame(tkinter.Frame):
         self.origen_marker = self.map_widget.set_marker(coords[0], coords[1], text="Tu Ubicación")
         algo_name = self.algorithm_info[self.algorithm_choice]["name"]
         self.set_status_text(f"Calculando ruta con {algo_name} desde ({coords[0]:.4f}, {coords[1]:.4f})...")
-        threading.Thread(target=self.encontrar_y_dibujar_ruta, args=(coords[0], coords[1]), daemon=True).start()
+        self.planificador.solicitar(coords[0], coords[1])
         
-    def encontrar_nodo_cercano(self, lat, lon):
-        _, indice = self.kd_tree_nodos.query([lat, lon])
-        return self.df_nodos.iloc[indice]['id']
-    
     def astar_heuristic(self, u, v):
         pos_u, pos_v = self.pos_nodos[u], self.pos_nodos[v]
         return math.sqrt((pos_u[0] - pos_v[0])**2 + (pos_u[1] - pos_v[1])**2)
 
-    def encontrar_y_dibujar_ruta(self, origen_lat, origen_lon):
-        if self.G_dirigido is None: return
+    def encontrar_y_dibujar_ruta(self, solicitud):
+        # Se ejecuta en el hilo del planificador; una solicitud cancelada se abandona sin avisar a la interfaz.
+        if self.grafo is None and self.grafo_particionado is None: return
+        from rutas import BusquedaCancelada
+        traza = solicitud.traza = trazas.iniciar("ruta", algoritmo=self.algorithm_choice)
         try:
             start_time = time.time()
-            nodo_origen = self.encontrar_nodo_cercano(origen_lat, origen_lon)
-            mejor_tiempo, mejor_destino_info = float('inf'), None
-            
+            with traza:
+                if self.campo_evacuacion is not None:
+                    resultado = self.encontrar_ruta_precalculada(solicitud)
+                elif self.buscador_csr is not None:
+                    resultado = self.encontrar_ruta_alt(solicitud)
+                elif self.grafo_particionado is not None:
+                    resultado = self.encontrar_ruta_particionada(solicitud)
+                else:
+                    resultado = self.encontrar_ruta_networkx(solicitud)
+            calc_time = time.time() - start_time
+            if resultado is None:
+                traza.terminar(sin_ruta=True)
+                self.entregar(solicitud, self.set_status_text, "No se encontró ruta a ningún punto seguro."); return
+            path_coords, mejor_destino_info, mejor_tiempo, detalle = resultado
+            self.entregar(solicitud, self.dibujar_ruta, path_coords, mejor_destino_info, mejor_tiempo, calc_time, detalle, solicitud)
+        except BusquedaCancelada:
+            traza.terminar(cancelada=True)
+        except Exception as e:
+            traza.terminar()
+            self.entregar(solicitud, self.set_status_text, f"Error al calcular la ruta: {e}")
+
+    def enganchar_origen(self, solicitud):
+        # Todos los modos parten del punto de la calle más cercano al clic: la búsqueda sale por los extremos
+        # del tramo permitidos por el sentido, pagando la fracción de tramo hasta cada uno.
+        # El modo particionado engancha con los tramos de las celdas vecinas en lugar del índice global.
+        from rutas import salidas_de_enganche
+        if self.grafo_particionado is not None:
+            enganche, pesos = self.grafo_particionado.enganchar([solicitud.lat], [solicitud.lon])
+        else:
+            enganche, pesos = self.indice_espacial.enganchar([solicitud.lat], [solicitud.lon]), self.grafo.pesos
+        return enganche, salidas_de_enganche(pesos, enganche)
+
+    def coordenadas_enganchadas(self, enganche, coordenadas_nodos, punto):
+        # La línea dibujada empieza sobre la calle del clic y termina sobre la calle del punto seguro.
+        return ([(enganche.lat[0], enganche.lon[0])] + list(coordenadas_nodos)
+                + [(self.enganche_seguros.lat[punto], self.enganche_seguros.lon[punto])])
+
+    def encontrar_ruta_networkx(self, solicitud):
+        import networkx as nx
+        from rutas import INTERVALO_CANCELACION, BusquedaCancelada
+        ids = self.grafo.ids
+        costo_final, punto_de_nodo = self.objetivos_seguros
+        with trazas.tramo("enganche"):
+            enganche, salidas = self.enganchar_origen(solicitud)
+        # Mejor combinación (costo total, nodo de salida, nodo de entrada al punto seguro).
+        mejor = (float('inf'), None, None)
+        # NetworkX pide el peso de cada arista al expandir su nodo de origen: la función de peso es el único
+        # punto dentro de una búsqueda en curso desde el que se puede cancelarla (lanzando BusquedaCancelada).
+        # Con las trazas activas también cuenta los nodos expandidos (los asentados sin aristas de salida no se ven);
+        # cada peso pedido es una arista relajada.
+        cancelacion = solicitud.cancelacion
+        estadisticas = {'nodos_asentados': 0, 'aristas_relajadas': 0}
+        llamadas = [0]
+        expandido = [None]
+
+        def peso_cancelable(u, v, datos):
+            llamadas[0] += 1
+            if llamadas[0] % INTERVALO_CANCELACION == 0 and cancelacion.is_set():
+                raise BusquedaCancelada()
+            return datos['weight']
+
+        def peso_contado(u, v, datos):
+            if u != expandido[0]:
+                expandido[0] = u
+                estadisticas['nodos_asentados'] += 1
+            return peso_cancelable(u, v, datos)
+
+        peso = peso_contado if trazas.activo() else peso_cancelable
+
+        with trazas.tramo("busqueda"):
             if self.algorithm_choice == "dijkstra":
-                distancias = nx.single_source_dijkstra_path_length(self.G_dirigido, source=nodo_origen, weight='weight')
-                for punto in self.puntos_seguros_data:
-                    nodo_destino = self.encontrar_nodo_cercano(punto["lat"], punto["lon"])
-                    if nodo_destino in distancias and distancias[nodo_destino] < mejor_tiempo:
-                        mejor_tiempo, mejor_destino_info = distancias[nodo_destino], punto
-            
+                for salida, costo_inicial in salidas.items():
+                    if not solicitud.vigente: raise BusquedaCancelada()
+                    expandido[0] = None
+                    distancias = nx.single_source_dijkstra_path_length(self.G_dirigido, source=int(ids[salida]), weight=peso)
+                    for entrada, costo in costo_final.items():
+                        distancia = distancias.get(int(ids[entrada]))
+                        if distancia is not None and costo_inicial + distancia + costo < mejor[0]:
+                            mejor = (costo_inicial + distancia + costo, salida, entrada)
+
             elif self.algorithm_choice == "astar":
-                for punto in self.puntos_seguros_data:
-                    try:
-                        nodo_destino = self.encontrar_nodo_cercano(punto["lat"], punto["lon"])
-                        if nodo_origen == nodo_destino: continue
-                        tiempo = nx.astar_path_length(self.G_dirigido, source=nodo_origen, target=nodo_destino, heuristic=self.astar_heuristic, weight='weight')
-                        if tiempo < mejor_tiempo: mejor_tiempo, mejor_destino_info = tiempo, punto
-                    except (nx.NetworkXNoPath, nx.NodeNotFound): continue
-            
-            if mejor_destino_info is None:
-                self.gui_queue.put((self.set_status_text, ("No se encontró ruta a ningún punto seguro.",))); return
+                for entrada, costo in costo_final.items():
+                    for salida, costo_inicial in salidas.items():
+                        if not solicitud.vigente: raise BusquedaCancelada()
+                        expandido[0] = None
+                        try:
+                            tiempo = nx.astar_path_length(self.G_dirigido, source=int(ids[salida]), target=int(ids[entrada]), heuristic=self.astar_heuristic, weight=peso)
+                            if costo_inicial + tiempo + costo < mejor[0]:
+                                mejor = (costo_inicial + tiempo + costo, salida, entrada)
+                        except (nx.NetworkXNoPath, nx.NodeNotFound): continue
+            estadisticas['aristas_relajadas'] = llamadas[0]
+            trazas.contar(**estadisticas)
 
-            final_nodo_destino = self.encontrar_nodo_cercano(mejor_destino_info["lat"], mejor_destino_info["lon"])
-            
-            path_finder = nx.dijkstra_path
-            path_args = {'weight': 'weight'}
-            if self.algorithm_choice == 'astar':
-                path_finder = nx.astar_path
-                path_args['heuristic'] = self.astar_heuristic
+        if not solicitud.vigente: raise BusquedaCancelada()
+        mejor_tiempo, salida, entrada = mejor
+        if entrada is None:
+            return None
 
-            ruta_nodos = path_finder(self.G_dirigido, source=nodo_origen, target=final_nodo_destino, **path_args)
-            
-            end_time = time.time()
-            calc_time = end_time - start_time
+        path_finder = nx.dijkstra_path
+        path_args = {'weight': peso_cancelable}
+        if self.algorithm_choice == 'astar':
+            path_finder = nx.astar_path
+            path_args['heuristic'] = self.astar_heuristic
 
+        # NetworkX no devuelve el camino junto con las distancias: la reconstrucción es una segunda búsqueda.
+        with trazas.tramo("reconstruccion"):
+            ruta_nodos = path_finder(self.G_dirigido, source=int(ids[salida]), target=int(ids[entrada]), **path_args)
             if not ruta_nodos: raise ValueError("El algoritmo no devolvió ninguna ruta.")
-            
-            path_coords = [self.pos_nodos[nodo] for nodo in ruta_nodos]
-            self.gui_queue.put((self.dibujar_ruta, (path_coords, mejor_destino_info, mejor_tiempo, calc_time)))
-        except Exception as e:
-            self.gui_queue.put((self.set_status_text, (f"Error al calcular la ruta: {e}",)))
+            punto = punto_de_nodo[entrada]
+            path_coords = self.coordenadas_enganchadas(enganche, [self.pos_nodos[nodo] for nodo in ruta_nodos], punto)
+        detalle = f" Nodos asentados: {estadisticas['nodos_asentados']}." if trazas.activo() else ""
+        return path_coords, self.puntos_seguros_data[punto], mejor_tiempo, detalle
+
+    def encontrar_ruta_precalculada(self, solicitud):
+        with trazas.tramo("enganche"):
+            enganche = self.indice_espacial.enganchar([solicitud.lat], [solicitud.lon])
+        with trazas.tramo("busqueda"):
+            nodos, costos, _ = self.campo_evacuacion.salida(enganche)
+        nodo, mejor_tiempo = nodos[0], costos[0]
+        if not math.isfinite(mejor_tiempo):
+            return None
+        with trazas.tramo("reconstruccion"):
+            destino = self.campo_evacuacion.destino[nodo]
+            mejor_destino_info = self.puntos_seguros_data[destino]
+            ruta_indices = self.campo_evacuacion.ruta(nodo)
+            coordenadas = zip(self.grafo.lat[ruta_indices].tolist(), self.grafo.lon[ruta_indices].tolist())
+            path_coords = self.coordenadas_enganchadas(enganche, coordenadas, destino)
+            trazas.contar(nodos_ruta=len(ruta_indices))
+        return path_coords, mejor_destino_info, mejor_tiempo, ""
+
+    def encontrar_ruta_alt(self, solicitud):
+        costo_final, punto_de_nodo = self.objetivos_seguros
+        with trazas.tramo("enganche"):
+            enganche, salidas = self.enganchar_origen(solicitud)
+        with trazas.tramo("busqueda"):
+            mejor_tiempo, ruta_indices, estadisticas = self.buscador_csr.buscar(salidas, costo_final, self.heuristica_alt, solicitud.cancelacion)
+            trazas.contar(**estadisticas)
+        if not ruta_indices:
+            return None
+        with trazas.tramo("reconstruccion"):
+            punto = punto_de_nodo[ruta_indices[-1]]
+            coordenadas = zip(self.grafo.lat[ruta_indices].tolist(), self.grafo.lon[ruta_indices].tolist())
+            path_coords = self.coordenadas_enganchadas(enganche, coordenadas, punto)
+        detalle = f" Nodos asentados: {estadisticas['nodos_asentados']}."
+        return path_coords, self.puntos_seguros_data[punto], mejor_tiempo, detalle
+
+    def encontrar_ruta_particionada(self, solicitud):
+        # Sólo se abren las celdas del origen, de los puntos seguros y de los atajos que forman la ruta.
+        costo_final, punto_de_nodo = self.objetivos_seguros
+        with trazas.tramo("enganche"):
+            enganche, salidas = self.enganchar_origen(solicitud)
+        with trazas.tramo("busqueda"):
+            mejor_tiempo, ruta_indices, estadisticas = self.grafo_particionado.buscar(salidas, costo_final, solicitud.cancelacion)
+            trazas.contar(**estadisticas)
+        if not ruta_indices:
+            return None
+        with trazas.tramo("reconstruccion"):
+            punto = punto_de_nodo[ruta_indices[-1]]
+            path_coords = self.coordenadas_enganchadas(enganche, self.grafo_particionado.coordenadas(ruta_indices), punto)
+        detalle = f" Nodos asentados: {estadisticas['nodos_asentados']}. Celdas completas: {estadisticas['celdas_completas']}."
+        return path_coords, self.puntos_seguros_data[punto], mejor_tiempo, detalle
 
     def calcular_y_dibujar_puntos_criticos(self):
-        if self.G_undirected is None: return
+        if self.grafo is None: return
         try:
+            from centralidad import calcular_centralidad, nodos_criticos
             start_time = time.time()
-            centrality = nx.betweenness_centrality(self.G_undirected, k=200, normalized=True, weight='weight')
-            
-            nodos_criticos = sorted(centrality, key=centrality.get, reverse=True)[:50]
+            ids = self.grafo.ids
+            traza = trazas.iniciar("puntos_criticos")
+
+            def al_progresar(parciales, completadas, total):
+                progreso = f"{completadas}/{total} fuentes"
+                self.gui_queue.put((self.dibujar_puntos_criticos, (ids[parciales].tolist(), time.time() - start_time, progreso)))
+
+            with traza, trazas.tramo("centralidad", muestras=200):
+                centrality = calcular_centralidad(self.grafo, k=200, al_progresar=al_progresar)
+                nodos = ids[nodos_criticos(centrality, 50)].tolist()
             end_time = time.time()
             calc_time = end_time - start_time
             
-            self.gui_queue.put((self.dibujar_puntos_criticos, (nodos_criticos, calc_time)))
+            self.gui_queue.put((self.dibujar_puntos_criticos, (nodos, calc_time, None, traza)))
 
         except Exception as e:
             self.gui_queue.put((self.set_status_text, (f"Error al calcular puntos críticos: {e}",)))
 
-    def dibujar_ruta(self, path_coords, destino_info, costo, calc_time):
-        # BUG FIX: Eliminar el marcador original del punto seguro antes de dibujar el nuevo.
-        dest_coords = (destino_info["lat"], destino_info["lon"])
-        if dest_coords in self.puntos_seguros_markers:
-            self.puntos_seguros_markers[dest_coords].delete()
+    def calcular_y_dibujar_asignacion(self):
+        if self.grafo is None: return
+        try:
+            import numpy as np
+            from asignacion import asignar_evacuacion
+            start_time = time.time()
+            traza = trazas.iniciar("asignacion")
+            capacidades = [p["capacidad"] for p in self.puntos_seguros_data] if all("capacidad" in p for p in self.puntos_seguros_data) else None
+            with traza, trazas.tramo("frank_wolfe"):
+                resultado = asignar_evacuacion(self.grafo, self.nodos_seguros, capacidad_puntos=capacidades)
+                trazas.contar(iteraciones=resultado.iteraciones)
+            # Sólo se dibujan las calles más cargadas para no saturar el mapa.
+            aristas = np.argsort(-resultado.flujo)[:400]
+            aristas = aristas[resultado.flujo[aristas] > 0]
+            origenes = self.grafo.origenes()[aristas]
+            destinos = self.grafo.indices[aristas]
+            tramos = [((self.grafo.lat[u], self.grafo.lon[u]), (self.grafo.lat[v], self.grafo.lon[v])) for u, v in zip(origenes, destinos)]
+            calc_time = time.time() - start_time
+            self.gui_queue.put((self.dibujar_asignacion, (tramos, resultado.saturacion[aristas].tolist(), resultado.carga_puntos.tolist(), resultado.capacidad_puntos.tolist(), calc_time, traza)))
+        except Exception as e:
+            self.gui_queue.put((self.set_status_text, (f"Error al calcular la asignación: {e}",)))
 
-        info = self.algorithm_info[self.algorithm_choice]
-        path = self.map_widget.set_path(path_coords, color=info["color"], width=4)
-        self.drawn_elements.append(path)
-        
-        self.destino_marker = self.map_widget.set_marker(destino_info["lat"], destino_info["lon"], text=f"Destino: {destino_info['nombre']}", text_color="#A4161A", marker_color_circle="#E63946", marker_color_outside="#A4161A")
-        self.last_destination_info = destino_info
-        self.set_status_text(f"Ruta a {destino_info['nombre']} encontrada en {calc_time:.2f}s. Costo: {costo:.2f} min.")
+    def dibujar_asignacion(self, tramos, saturaciones, cargas, capacidades, calc_time, traza=trazas.NULO):
+        with traza, trazas.tramo("dibujo"):
+            self.limpiar_mapa()
+            for tramo, saturacion in zip(tramos, saturaciones):
+                color = "#2A9D8F" if saturacion < 0.5 else "#F4A261" if saturacion < 1 else "#E63946"
+                self.drawn_elements.append(self.map_widget.set_path(list(tramo), color=color, width=4 if saturacion >= 1 else 3))
+            for punto, carga, capacidad in zip(self.puntos_seguros_data, cargas, capacidades):
+                coords = (punto["lat"], punto["lon"])
+                if coords in self.puntos_seguros_markers:
+                    self.puntos_seguros_markers[coords].delete()
+                saturado = carga > capacidad
+                self.puntos_seguros_markers[coords] = self.map_widget.set_marker(
+                    punto["lat"], punto["lon"], text=f"{punto['nombre']}: {carga:,.0f} / {capacidad:,.0f} personas",
+                    text_color="#A4161A" if saturado else "#2E603A", marker_color_circle="#E63946" if saturado else "#588157",
+                    marker_color_outside="#A4161A" if saturado else "#2E603A")
+        traza.terminar()
+        self.set_status_text(f"Asignación de evacuación calculada en {calc_time:.2f}s. Rojo: calles y puntos seguros sobre su capacidad.")
+
+    def dibujar_ruta(self, path_coords, destino_info, costo, calc_time, detalle="", solicitud=None):
+        traza = solicitud.traza if solicitud is not None else trazas.NULO
+        with traza, trazas.tramo("dibujo"):
+            # BUG FIX: Eliminar el marcador original del punto seguro antes de dibujar el nuevo.
+            dest_coords = (destino_info["lat"], destino_info["lon"])
+            if dest_coords in self.puntos_seguros_markers:
+                self.puntos_seguros_markers[dest_coords].delete()
+
+            info = self.algorithm_info[self.algorithm_choice]
+            path = self.map_widget.set_path(path_coords, color=info["color"], width=4)
+            self.drawn_elements.append(path)
+            
+            self.destino_marker = self.map_widget.set_marker(destino_info["lat"], destino_info["lon"], text=f"Destino: {destino_info['nombre']}", text_color="#A4161A", marker_color_circle="#E63946", marker_color_outside="#A4161A")
+            self.last_destination_info = destino_info
+        if solicitud is not None and self.planificador is not None:
+            latencia = self.planificador.registrar_dibujo(solicitud)
+            metricas = self.planificador.metricas()
+            traza.terminar(latencia_ms=latencia * 1000)
+            detalle += (f" Clic→ruta: {latencia * 1000:.0f} ms (media {metricas['latencia_media_ms']:.0f} ms);"
+                        f" en cola: {metricas['profundidad_cola']}, canceladas: {metricas['canceladas']}.")
+        self.set_status_text(f"Ruta a {destino_info['nombre']} encontrada en {calc_time:.2f}s. Costo: {costo:.2f} min.{detalle}")
 
     def create_circle_polygon(self, lat, lon, radius_meters, num_points=20):
         coords = []
@@ -258,29 +460,101 @@ class MapViewFrame(tkinter.Frame):
             coords.append((lat + dy, lon + dx))
         return coords
 
-    def dibujar_puntos_criticos(self, nodos_criticos, calc_time):
-        self.limpiar_mapa()
-        info = self.algorithm_info[self.algorithm_choice]
-        
-        for i, nodo_id in enumerate(nodos_criticos):
-            pos = self.pos_nodos[nodo_id]
+    def dibujar_puntos_criticos(self, nodos_criticos, calc_time, progreso=None, traza=trazas.NULO):
+        with traza, trazas.tramo("dibujo"):
+            self.limpiar_mapa()
+            info = self.algorithm_info[self.algorithm_choice]
             
-            circle_coords = self.create_circle_polygon(pos[0], pos[1], radius_meters=50)
-            polygon = self.map_widget.set_polygon(
-                circle_coords,
-                fill_color=info['color'],
-                outline_color=info['color'],
-                border_width=2,
-                name=f"critical_circle_{i}"
-            )
-            self.drawn_elements.append(polygon)
+            for i, nodo_id in enumerate(nodos_criticos):
+                pos = self.pos_nodos[nodo_id]
+                
+                circle_coords = self.create_circle_polygon(pos[0], pos[1], radius_meters=50)
+                polygon = self.map_widget.set_polygon(
+                    circle_coords,
+                    fill_color=info['color'],
+                    outline_color=info['color'],
+                    border_width=2,
+                    name=f"critical_circle_{i}"
+                )
+                self.drawn_elements.append(polygon)
+        traza.terminar()
             
-        self.set_status_text(f"Análisis de {len(nodos_criticos)} puntos críticos completado en {calc_time:.2f}s.")
+        if progreso:
+            self.set_status_text(f"Resultados parciales ({progreso}) tras {calc_time:.2f}s. Calculando...")
+        else:
+            self.set_status_text(f"Análisis de {len(nodos_criticos)} puntos críticos completado en {calc_time:.2f}s.")
+
+
+class PanelDiagnostico(tkinter.Toplevel):
+    # Últimas trazas registradas, como árbol de tramos con su duración, contadores y atributos.
+    def __init__(self, map_frame):
+        super().__init__(map_frame)
+        self.map_frame = map_frame
+        self.title("Diagnóstico")
+        self.geometry("760x480")
+        barra = ttk.Frame(self, padding="5 5 5 5")
+        barra.pack(fill="x")
+        self.activo_var = tkinter.BooleanVar(value=trazas.activo())
+        self.perfil_var = tkinter.BooleanVar(value=False)
+        ttk.Checkbutton(barra, text="Registrar trazas", variable=self.activo_var, command=self.cambiar_estado).pack(side="left", padx=5)
+        ttk.Checkbutton(barra, text="Perfilar (cProfile)", variable=self.perfil_var, command=self.cambiar_estado).pack(side="left", padx=5)
+        self.metricas_label = ttk.Label(barra, text="", anchor="w")
+        self.metricas_label.pack(side="left", padx=10, expand=True, fill="x")
+        self.arbol = ttk.Treeview(self, columns=("duracion", "detalle"), show="tree headings")
+        self.arbol.heading("#0", text="Tramo")
+        self.arbol.heading("duracion", text="ms")
+        self.arbol.heading("detalle", text="Contadores y atributos")
+        self.arbol.column("#0", width=220)
+        self.arbol.column("duracion", width=80, anchor="e")
+        self.arbol.column("detalle", width=440)
+        self.arbol.pack(fill="both", expand=True, padx=5, pady=(0, 5))
+        self.mostradas = None
+        self.actualizar()
+
+    def cambiar_estado(self):
+        if self.activo_var.get():
+            trazas.activar(trazas.ruta_log(self.map_frame.app.servicio.directorio_cache), perfil=self.perfil_var.get())
+        else:
+            trazas.desactivar()
+
+    def insertar(self, padre, registro):
+        detalle = {**registro.get('contadores', {}), **registro.get('atributos', {})}
+        texto = ", ".join(f"{clave}={valor:.1f}" if isinstance(valor, float) else f"{clave}={valor}" for clave, valor in detalle.items())
+        nodo = self.arbol.insert(padre, "end", text=registro['nombre'], values=(f"{registro['duracion_ms']:.1f}", texto), open=padre == "")
+        for hijo in registro.get('hijos', []):
+            self.insertar(nodo, hijo)
+        if registro.get('perfil'):
+            perfil = self.arbol.insert(nodo, "end", text="perfil", values=("", ""))
+            for linea in registro['perfil'].splitlines():
+                if linea.strip(): self.arbol.insert(perfil, "end", text="", values=("", linea.strip()))
+
+    def actualizar(self):
+        planificador = self.map_frame.planificador
+        if planificador is not None:
+            m = planificador.metricas()
+            latencia = f"{m['latencia_media_ms']:.0f} ms" if m['latencia_media_ms'] is not None else "-"
+            self.metricas_label.config(text=f"Cola: {m['profundidad_cola']} | Solicitudes: {m['solicitudes']} | Descartadas: {m['descartadas']} | "
+                                            f"Canceladas: {m['canceladas']} | Latencia media clic→ruta: {latencia}")
+        registros = trazas.historial()
+        clave = (len(registros), registros[-1]['inicio'] if registros else None)
+        if clave != self.mostradas:
+            self.mostradas = clave
+            self.arbol.delete(*self.arbol.get_children())
+            for registro in reversed(registros):
+                self.insertar("", registro)
+        self.after_id = self.after(1000, self.actualizar)
+
+    def destroy(self):
+        self.after_cancel(self.after_id)
+        super().destroy()
 
 
 class App(tkinter.Tk):
-    def __init__(self):
+    EVENTO_PRECALENTAMIENTO = "<<PrecalentamientoTerminado>>"
+
+    def __init__(self, precalentar=True):
         super().__init__()
+        self.precalentar = precalentar
         self.title("Sistema de Rutas y Análisis de Redes")
         self.geometry("1100x800")
         self.minsize(800, 600)
@@ -300,6 +574,8 @@ class App(tkinter.Tk):
         self.container = ttk.Frame(self)
         self.container.pack(fill="both", expand=True)
         self.menu_frame, self.map_frame, self.info_frame = None, None, None
+        self.servicio = obtener_servicio()
+        self.bind(self.EVENTO_PRECALENTAMIENTO, self.mostrar_estado_precalentamiento)
         self.show_menu()
 
     def show_menu(self):
@@ -315,11 +591,15 @@ class App(tkinter.Tk):
         ttk.Label(route_frame, text="Encuentra el camino más rápido desde tu ubicación a un punto seguro.").pack(pady=(0,15))
         ttk.Button(route_frame, text="🧭 Ruta con Dijkstra", style='Accent.TButton', command=lambda: self.abrir_mapa("dijkstra")).pack(pady=5, fill='x', ipady=5)
         ttk.Button(route_frame, text="⭐ Ruta con A-Star (A*)", style='Accent.TButton', command=lambda: self.abrir_mapa("astar")).pack(pady=5, fill='x', ipady=5)
+        ttk.Button(route_frame, text="📍 Ruta con A* y Landmarks (ALT)", style='Accent.TButton', command=lambda: self.abrir_mapa("alt")).pack(pady=5, fill='x', ipady=5)
+        ttk.Button(route_frame, text="⚡ Ruta Precalculada (Dijkstra Multi-Origen)", style='Accent.TButton', command=lambda: self.abrir_mapa("precalculado")).pack(pady=5, fill='x', ipady=5)
+        ttk.Button(route_frame, text="🧩 Ruta sobre Grafo Particionado (Celdas)", style='Accent.TButton', command=lambda: self.abrir_mapa("particionado")).pack(pady=5, fill='x', ipady=5)
 
         network_frame = ttk.LabelFrame(self.menu_frame, text=" Análisis de la Red de Evacuación ", padding="20 10")
         network_frame.pack(pady=15, fill='x', expand=True)
         ttk.Label(network_frame, text="Identifica las intersecciones más críticas (cuellos de botella) en el mapa.").pack(pady=(0,15))
         ttk.Button(network_frame, text="🚦 Identificar Cuellos de Botella (Centralidad)", style='Accent.TButton', command=lambda: self.abrir_mapa("centrality")).pack(pady=5, fill='x', ipady=5)
+        ttk.Button(network_frame, text="👥 Evacuación Masiva con Capacidades", style='Accent.TButton', command=lambda: self.abrir_mapa("asignacion")).pack(pady=5, fill='x', ipady=5)
         
         ttk.Separator(self.menu_frame, orient='horizontal').pack(pady=30, fill='x')
         
@@ -343,7 +623,26 @@ class App(tkinter.Tk):
         ttk.Button(secondary_buttons_frame, text="ℹ️ Sobre el Proyecto", style='Secondary.TButton', command=lambda: self.show_info_page("Sobre el Proyecto", info_proyecto, 'left')).pack(side='left', padx=10)
         ttk.Button(secondary_buttons_frame, text="❌ Salir", style='Secondary.TButton', command=self.destroy).pack(side='left', padx=10)
         
+        self.estado_menu = ttk.Label(self.menu_frame, text="", style='Content.TLabel', foreground="#B00020")
+        self.estado_menu.pack(pady=5)
+        
         self.menu_frame.pack(fill="both", expand=True)
+        # Los datos se cargan mientras el usuario elige una opción; después de la primera vez no hace nada.
+        if self.precalentar:
+            self.after_idle(self.servicio.precalentar, self.avisar_precalentamiento)
+        self.mostrar_estado_precalentamiento()
+
+    def avisar_precalentamiento(self):
+        # Se llama desde el hilo del precalentamiento: el aviso llega a Tk como evento virtual.
+        try:
+            self.event_generate(self.EVENTO_PRECALENTAMIENTO, when="tail")
+        except (tkinter.TclError, RuntimeError):
+            pass
+
+    def mostrar_estado_precalentamiento(self, event=None):
+        error = self.servicio.error_precalentamiento
+        if error is not None and self.estado_menu.winfo_exists():
+            self.estado_menu.config(text=f"⚠️ No se pudieron cargar los datos en segundo plano: {error}")
 
     def abrir_mapa(self, algorithm_choice: str):
         if self.menu_frame: self.menu_frame.pack_forget()
@@ -362,6 +661,120 @@ class App(tkinter.Tk):
         content_label.bind('<Configure>', lambda e: content_label.config(wraplength=e.width))
         ttk.Button(center_frame, text="◄ Volver al Menú", style='Accent.TButton', command=self.show_menu).pack(pady=30)
 
+def ejecutar_comando(args):
+    servicio = obtener_servicio()
+
+    if args.comando == "lote":
+        from lote import rutear_lote
+        inicio = time.time()
+        filas = rutear_lote(args.origenes, args.salida, procesos=args.procesos, tamano_bloque=args.bloque, con_geometria=args.geometria,
+                            al_progresar=lambda n: print(f"{n} orígenes procesados...", flush=True))
+        print(f"{filas} rutas escritas en '{args.salida}' en {time.time() - inicio:.2f}s.")
+    elif args.comando == "centralidad":
+        import pandas as pd
+        from centralidad import calcular_centralidad, nodos_criticos
+        inicio = time.time()
+        grafo = servicio.grafo
+        centralidad = calcular_centralidad(grafo, k=args.muestras, semilla=args.semilla, exacta=args.exacta, procesos=args.procesos,
+                                           al_progresar=lambda _, hechas, total: print(f"{hechas}/{total} fuentes procesadas...", flush=True))
+        criticos = nodos_criticos(centralidad)
+        if args.salida:
+            pd.DataFrame({'id': grafo.ids[criticos], 'lat': grafo.lat[criticos], 'lon': grafo.lon[criticos], 'centralidad': centralidad[criticos]}).to_csv(args.salida, index=False)
+        print(f"Centralidad de {grafo.num_nodos} nodos calculada en {time.time() - inicio:.2f}s.")
+    elif args.comando == "escenarios":
+        from escenarios import simular_escenarios
+        inicio = time.time()
+        grafo = servicio.grafo
+        resultado = simular_escenarios(grafo, servicio.nodos_seguros, num_escenarios=args.escenarios, intensidad=args.intensidad, semilla=args.semilla, procesos=args.procesos,
+                                       al_progresar=lambda hechos, total: print(f"{hechos}/{total} escenarios simulados...", flush=True))
+        resultado.a_dataframe(grafo).to_csv(args.salida, index=False)
+        print(f"{args.escenarios} escenarios simulados en {time.time() - inicio:.2f}s. Probabilidad media de aislamiento: {resultado.prob_aislado.mean():.3f}.")
+    elif args.comando == "asignacion":
+        import numpy as np
+        import pandas as pd
+        from asignacion import asignar_evacuacion
+        inicio = time.time()
+        grafo = servicio.grafo
+        indice_espacial = servicio.indice_espacial
+        df_puntos_seguros = pd.read_csv(RUTA_PUNTOS)
+        nodos_seguros = servicio.nodos_seguros
+        demanda = None
+        if args.poblacion:
+            df_poblacion = pd.read_csv(args.poblacion)
+            indices = indice_espacial.nodos_cercanos(df_poblacion['lat'], df_poblacion['lon'])
+            demanda = np.bincount(indices, weights=df_poblacion['poblacion'].to_numpy(dtype=np.float64), minlength=grafo.num_nodos)
+        capacidades = df_puntos_seguros['capacidad'].to_numpy(dtype=np.float64) if 'capacidad' in df_puntos_seguros else None
+        resultado = asignar_evacuacion(grafo, nodos_seguros, demanda=demanda, capacidad_puntos=capacidades, max_iteraciones=args.iteraciones)
+        resultado.a_dataframe_aristas(grafo).to_csv(args.salida, index=False)
+        for nombre, carga, capacidad in zip(df_puntos_seguros['nombre'], resultado.carga_puntos, resultado.capacidad_puntos):
+            print(f"{nombre}: {carga:,.0f} / {capacidad:,.0f} personas")
+        print(f"Asignación calculada en {time.time() - inicio:.2f}s ({resultado.iteraciones} iteraciones, brecha relativa {resultado.brecha:.4f}).")
+    elif args.comando == "benchmark":
+        from benchmark import ejecutar_suite
+        inicio = time.time()
+        ejecutar_suite(args.salida, tamanos_sinteticos=args.sintetico, incluir_lima=not args.sin_lima, directorio_sintetico=args.directorio_sintetico,
+                       semilla=args.semilla, consultas=args.consultas, repeticiones=args.repeticiones,
+                       con_networkx=False if args.sin_networkx else None, memoria=not args.sin_memoria,
+                       al_progresar=lambda texto: print(texto, flush=True))
+        print(f"Benchmark guardado en '{args.salida}' en {time.time() - inicio:.2f}s.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sistema de Rutas de Evacuación Sísmica")
+    parser.add_argument("--trazas", action="store_true", help="Registra trazas por etapa en un log JSON-lines rotativo.")
+    parser.add_argument("--log", default=trazas.ruta_log(DIRECTORIO_CACHE), metavar="RUTA",
+                        help=f"Log de --trazas y --perfil (por defecto '{trazas.ruta_log(DIRECTORIO_CACHE)}').")
+    parser.add_argument("--perfil", action="store_true", help="Además de las trazas, perfila cada tramo raíz con cProfile.")
+    parser.add_argument("--sin-precalentar", action="store_true",
+                        help="No carga la red completa al abrir el menú (para usar sólo el modo particionado con poca memoria).")
+    subparsers = parser.add_subparsers(dest="comando")
+    lote_parser = subparsers.add_parser("lote", help="Calcula rutas de evacuación para un CSV de orígenes (columnas lat, lon y opcionalmente id) sin interfaz gráfica.")
+    lote_parser.add_argument("origenes", help="CSV de orígenes.")
+    lote_parser.add_argument("salida", help="Archivo de resultados (.csv o .parquet).")
+    lote_parser.add_argument("--procesos", type=int, default=None, help="Número de procesos (por defecto, uno por CPU).")
+    lote_parser.add_argument("--bloque", type=int, default=50_000, help="Orígenes por bloque.")
+    lote_parser.add_argument("--geometria", action="store_true", help="Incluye la ruta como WKT LINESTRING.")
+    centralidad_parser = subparsers.add_parser("centralidad", help="Calcula la centralidad de intermediación y la guarda en la caché.")
+    centralidad_parser.add_argument("--muestras", type=int, default=200, help="Número de nodos fuente muestreados.")
+    centralidad_parser.add_argument("--semilla", type=int, default=0)
+    centralidad_parser.add_argument("--exacta", action="store_true", help="Usa todos los nodos como fuente (para ejecuciones offline).")
+    centralidad_parser.add_argument("--procesos", type=int, default=None, help="Número de procesos (por defecto, uno por CPU).")
+    centralidad_parser.add_argument("--salida", default=None, help="CSV opcional con los nodos críticos.")
+    escenarios_parser = subparsers.add_parser("escenarios", help="Simulación Monte Carlo de cierres de calles por sismo.")
+    escenarios_parser.add_argument("salida", help="CSV con la probabilidad de aislamiento y la distribución de costos por nodo.")
+    escenarios_parser.add_argument("--escenarios", type=int, default=1000, help="Número de escenarios simulados.")
+    escenarios_parser.add_argument("--intensidad", type=float, default=0.1, help="Probabilidad de cierre = vulnerabilidad × intensidad.")
+    escenarios_parser.add_argument("--semilla", type=int, default=0)
+    escenarios_parser.add_argument("--procesos", type=int, default=None, help="Número de procesos (por defecto, uno por CPU).")
+    asignacion_parser = subparsers.add_parser("asignacion", help="Asigna toda la población a los puntos seguros respetando capacidades.")
+    asignacion_parser.add_argument("salida", help="CSV con el flujo y la saturación de cada arista.")
+    asignacion_parser.add_argument("--poblacion", default=None, help="CSV con columnas lat, lon y poblacion (por defecto, 50 personas por nodo).")
+    asignacion_parser.add_argument("--iteraciones", type=int, default=100, help="Máximo de iteraciones de Frank-Wolfe.")
+    benchmark_parser = subparsers.add_parser("benchmark", help="Mide cada etapa (carga, construcción, enganche, rutas, centralidad) y guarda los resultados en JSON.")
+    benchmark_parser.add_argument("salida", help="Archivo JSON de resultados.")
+    benchmark_parser.add_argument("--sintetico", type=int, nargs="*", default=[], help="Tamaños (en nodos) de grillas sintéticas a medir, p. ej. 10000 100000 1000000.")
+    benchmark_parser.add_argument("--sin-lima", action="store_true", help="No mide la red real de Lima.")
+    benchmark_parser.add_argument("--consultas", type=int, default=20, help="Orígenes aleatorios por etapa de rutas.")
+    benchmark_parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por etapa; se informa el mínimo y la mediana.")
+    benchmark_parser.add_argument("--semilla", type=int, default=0)
+    benchmark_parser.add_argument("--sin-networkx", action="store_true", help="Omite las etapas con NetworkX.")
+    benchmark_parser.add_argument("--sin-memoria", action="store_true", help="Omite las mediciones del pico de memoria (RSS y tracemalloc).")
+    benchmark_parser.add_argument("--directorio-sintetico", default=None, help="Conserva los CSV sintéticos generados en este directorio.")
+    args = parser.parse_args(argv)
+    if args.comando == "escenarios" and args.escenarios < 1:
+        escenarios_parser.error("--escenarios debe ser al menos 1.")
+    if args.trazas or args.perfil:
+        trazas.activar(args.log, perfil=args.perfil)
+    else:
+        trazas.activar_desde_entorno(args.log)
+
+    if args.comando:
+        with trazas.tramo(args.comando):
+            ejecutar_comando(args)
+    else:
+        app = App(precalentar=not args.sin_precalentar)
+        app.mainloop()
+
 if __name__ == "__main__":
-    app = App()
-    app.mainloop()
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,264 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+import trazas
+from servicio_datos import RUTA_NODOS, RUTA_ARISTAS, DIRECTORIO_CACHE
+
+# Cambiar este número cuando cambie el formato de los arreglos guardados en caché.
+VERSION_CACHE = 4
+VELOCIDAD_POR_DEFECTO = 30
+ARREGLOS = ("ids", "lat", "lon", "indptr", "indices", "pesos", "longitudes", "calle", "indptr_nd", "indices_nd", "pesos_nd",
+            "vulnerabilidad_calles", "velocidad_calles", "tipo_via_calles")
+
+
+def calcular_velocidades(df_aristas):
+    # Una velocidad por fila; sin la columna velocidad_max todas las calles usan la velocidad por defecto.
+    if 'velocidad_max' not in df_aristas:
+        return np.full(len(df_aristas), VELOCIDAD_POR_DEFECTO, dtype=np.float64)
+    velocidad = pd.to_numeric(df_aristas['velocidad_max'], errors='coerce')
+    return np.where(velocidad > 0, velocidad, VELOCIDAD_POR_DEFECTO).astype(np.float64)
+
+
+def calcular_pesos(df_aristas):
+    # Costo = Tiempo_Base × Factor_Riesgo, igual que en la versión por filas.
+    velocidad = calcular_velocidades(df_aristas)
+    distancia_km = df_aristas['longitud'].to_numpy(dtype=np.float64) / 1000
+    tiempo_en_minutos = (distancia_km / velocidad) * 60
+    vulnerabilidad = df_aristas['vulnerabilidad'].to_numpy(dtype=np.float64) if 'vulnerabilidad' in df_aristas else 0.0
+    penalizacion_riesgo = 1 + (vulnerabilidad * 2.0)
+    return tiempo_en_minutos * penalizacion_riesgo
+
+
+def hash_entradas(*rutas, version=VERSION_CACHE, parametros=None):
+    # Identifica una caché por el contenido de sus archivos de entrada, la versión de su formato
+    # y los parámetros que cambian su contenido.
+    h = hashlib.sha1(f"v{version}".encode())
+    if parametros is not None:
+        h.update(repr(parametros).encode())
+    for ruta in rutas:
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloque)
+    return h.hexdigest()[:16]
+
+
+def a_csr(u, v, w, n, *extras):
+    # Aristas (u, v, w) y columnas extra por arista a CSR con filas por origen y destinos ordenados.
+    orden = np.lexsort((v, u))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=n), out=indptr[1:])
+    return (indptr, v[orden].astype(np.int32), w[orden].astype(np.float64)) + tuple(e[orden] for e in extras)
+
+
+class GrafoCompilado:
+    def __init__(self, arreglos, clave=None, directorio=None):
+        for nombre in ARREGLOS:
+            setattr(self, nombre, arreglos[nombre])
+        self.clave = clave
+        # Directorio de la caché en disco; None si el grafo sólo existe en memoria.
+        self.directorio = directorio
+        self._indice_por_id = None
+
+    @property
+    def num_nodos(self):
+        return len(self.ids)
+
+    @property
+    def num_aristas(self):
+        return len(self.indices)
+
+    @property
+    def num_calles(self):
+        return len(self.vulnerabilidad_calles)
+
+    @property
+    def indice_por_id(self):
+        if self._indice_por_id is None:
+            self._indice_por_id = dict(zip(self.ids.tolist(), range(self.num_nodos)))
+        return self._indice_por_id
+
+    def coordenadas(self):
+        return np.column_stack([self.lat, self.lon])
+
+    def pos_nodos(self):
+        return dict(zip(self.ids.tolist(), zip(self.lat.tolist(), self.lon.tolist())))
+
+    def indice_arista(self, u, v):
+        # Las filas CSR están ordenadas por destino, así que la clave u * n + v queda ordenada.
+        # Devuelve -1 para los pares que no tienen arista.
+        n = self.num_nodos
+        claves = self.origenes().astype(np.int64) * n + self.indices
+        buscadas = np.asarray(u, dtype=np.int64) * n + v
+        posicion = np.minimum(np.searchsorted(claves, buscadas), len(claves) - 1)
+        return np.where(claves[posicion] == buscadas, posicion, -1)
+
+    def matriz(self):
+        n = self.num_nodos
+        return csr_matrix((self.pesos, self.indices, self.indptr), shape=(n, n))
+
+    def origenes(self, indptr=None):
+        indptr = self.indptr if indptr is None else indptr
+        return np.repeat(np.arange(self.num_nodos, dtype=np.int32), np.diff(indptr))
+
+    def a_networkx(self):
+        import networkx as nx
+        ids = self.ids.tolist()
+        G_undirected, G_dirigido = nx.Graph(), nx.DiGraph()
+        G_undirected.add_nodes_from(ids)
+        G_dirigido.add_nodes_from(ids)
+        u = self.ids[self.origenes(self.indptr_nd)].tolist()
+        v = self.ids[self.indices_nd].tolist()
+        G_undirected.add_weighted_edges_from(zip(u, v, self.pesos_nd.tolist()))
+        u = self.ids[self.origenes()].tolist()
+        v = self.ids[self.indices].tolist()
+        G_dirigido.add_weighted_edges_from(zip(u, v, self.pesos.tolist()))
+        return G_undirected, G_dirigido
+
+
+def compilar_grafo(nodos_path=RUTA_NODOS, aristas_path=RUTA_ARISTAS):
+    df_nodos = pd.read_csv(nodos_path).dropna(subset=['lat', 'lon']).drop_duplicates('id', keep='last')
+    df_aristas = pd.read_csv(aristas_path)
+    # Sólo se conservan las calles cuyos extremos tienen coordenadas.
+    df_aristas = df_aristas[df_aristas['origen'].isin(df_nodos['id']) & df_aristas['destino'].isin(df_nodos['id'])]
+
+    ids_nodos = df_nodos['id'].to_numpy(dtype=np.int64)
+    origen = pd.Index(ids_nodos).get_indexer(df_aristas['origen'])
+    destino = pd.Index(ids_nodos).get_indexer(df_aristas['destino'])
+    peso = calcular_pesos(df_aristas)
+    longitud = df_aristas['longitud'].to_numpy(dtype=np.float64)
+    if 'sentido_unico' in df_aristas:
+        doble_sentido = ~df_aristas['sentido_unico'].fillna(False).astype(bool).to_numpy()
+    else:
+        doble_sentido = np.ones(len(df_aristas), dtype=bool)
+
+    # Como en add_edge, si una arista aparece repetida gana la última.
+    n_filas = len(df_aristas)
+    posicion = np.arange(n_filas) * 2
+    dirigidas = pd.DataFrame({
+        'u': np.concatenate([origen, destino[doble_sentido]]),
+        'v': np.concatenate([destino, origen[doble_sentido]]),
+        'w': np.concatenate([peso, peso[doble_sentido]]),
+        'l': np.concatenate([longitud, longitud[doble_sentido]]),
+        'calle': np.concatenate([np.arange(n_filas), np.arange(n_filas)[doble_sentido]]),
+        'pos': np.concatenate([posicion, posicion[doble_sentido] + 1]),
+    }).sort_values('pos').drop_duplicates(['u', 'v'], keep='last')
+    no_dirigidas = pd.DataFrame({
+        'u': np.minimum(origen, destino), 'v': np.maximum(origen, destino), 'w': peso,
+    }).drop_duplicates(['u', 'v'], keep='last')
+
+    n = len(ids_nodos)
+    u_nd, v_nd, w_nd = (no_dirigidas[c].to_numpy() for c in ('u', 'v', 'w'))
+    adyacencia = csr_matrix((np.ones(len(u_nd)), (u_nd, v_nd)), shape=(n, n))
+    _, etiquetas = connected_components(adyacencia, directed=False)
+    # Los nodos sin calles no forman parte del grafo, como en add_edge.
+    con_calles = np.zeros(n, dtype=bool)
+    con_calles[u_nd] = con_calles[v_nd] = True
+    conteo = np.bincount(etiquetas[con_calles], minlength=etiquetas.max() + 1)
+    en_componente = etiquetas == np.argmax(conteo)
+
+    nuevo_indice = np.full(n, -1, dtype=np.int64)
+    nuevo_indice[en_componente] = np.arange(en_componente.sum())
+    m = int(en_componente.sum())
+
+    u, v, w, l, fila = (dirigidas[c].to_numpy() for c in ('u', 'v', 'w', 'l', 'calle'))
+    dentro = en_componente[u] & en_componente[v]
+    indptr, indices, pesos, longitudes, fila = a_csr(nuevo_indice[u[dentro]], nuevo_indice[v[dentro]], w[dentro], m, l[dentro], fila[dentro])
+    # Las dos direcciones de una calle comparten el mismo número de calle.
+    filas_calles, calle = np.unique(fila, return_inverse=True)
+    vulnerabilidad = df_aristas['vulnerabilidad'].to_numpy(dtype=np.float64) if 'vulnerabilidad' in df_aristas else np.zeros(n_filas)
+    tipo_via = df_aristas['tipo_via'].fillna('').to_numpy(dtype=str) if 'tipo_via' in df_aristas else np.full(n_filas, '')
+
+    dentro = en_componente[u_nd] & en_componente[v_nd]
+    u_nd, v_nd, w_nd = nuevo_indice[u_nd[dentro]], nuevo_indice[v_nd[dentro]], w_nd[dentro]
+    indptr_nd, indices_nd, pesos_nd = a_csr(
+        np.concatenate([u_nd, v_nd[u_nd != v_nd]]), np.concatenate([v_nd, u_nd[u_nd != v_nd]]),
+        np.concatenate([w_nd, w_nd[u_nd != v_nd]]), m)
+
+    return GrafoCompilado({
+        'ids': ids_nodos[en_componente],
+        'lat': df_nodos['lat'].to_numpy(dtype=np.float64)[en_componente],
+        'lon': df_nodos['lon'].to_numpy(dtype=np.float64)[en_componente],
+        'indptr': indptr, 'indices': indices, 'pesos': pesos, 'longitudes': longitudes, 'calle': calle.astype(np.int32),
+        'vulnerabilidad_calles': vulnerabilidad[filas_calles],
+        'velocidad_calles': calcular_velocidades(df_aristas)[filas_calles],
+        'tipo_via_calles': tipo_via[filas_calles],
+        'indptr_nd': indptr_nd, 'indices_nd': indices_nd, 'pesos_nd': pesos_nd,
+    })
+
+
+def guardar_grafo(grafo, directorio):
+    padre = os.path.dirname(os.path.abspath(directorio))
+    os.makedirs(padre, exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=padre)
+    try:
+        for nombre in ARREGLOS:
+            np.save(os.path.join(temporal, f"{nombre}.npy"), np.ascontiguousarray(getattr(grafo, nombre)))
+        os.replace(temporal, directorio)
+    except OSError:
+        # Otro proceso pudo haber escrito la misma caché al mismo tiempo.
+        shutil.rmtree(temporal, ignore_errors=True)
+        if not os.path.isdir(directorio):
+            raise
+
+
+def leer_grafo(directorio, clave=None):
+    arreglos = {nombre: np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode='r') for nombre in ARREGLOS}
+    return GrafoCompilado(arreglos, clave=clave, directorio=directorio)
+
+
+def directorio_grafo(clave, directorio_cache=DIRECTORIO_CACHE):
+    return os.path.join(directorio_cache, f"grafo_{clave}")
+
+
+def cargar_grafo(nodos_path=RUTA_NODOS, aristas_path=RUTA_ARISTAS, directorio_cache=DIRECTORIO_CACHE):
+    clave = hash_entradas(nodos_path, aristas_path)
+    directorio = directorio_grafo(clave, directorio_cache)
+    if os.path.isdir(directorio):
+        try:
+            with trazas.tramo("lectura_cache"):
+                return leer_grafo(directorio, clave)
+        except (OSError, ValueError):
+            shutil.rmtree(directorio, ignore_errors=True)
+    with trazas.tramo("compilacion_grafo"):
+        grafo = compilar_grafo(nodos_path, aristas_path)
+    grafo.clave = clave
+    try:
+        guardar_grafo(grafo, directorio)
+        grafo.directorio = directorio
+    except OSError:
+        # Sin permisos de escritura se trabaja sólo en memoria.
+        pass
+    return grafo
+
+
+def arreglos_en_cache(grafo, nombre, calcular):
+    # Arreglos derivados del grafo (landmarks, centralidad, ...) que se guardan junto a su caché.
+    ruta = os.path.join(grafo.directorio, f"{nombre}.npz") if grafo.directorio else None
+    return npz_en_cache(ruta, calcular)
+
+
+def npz_en_cache(ruta, calcular):
+    # Lee el .npz si existe; si no, calcula el diccionario de arreglos y lo escribe de forma atómica.
+    if ruta and os.path.exists(ruta):
+        try:
+            with np.load(ruta) as datos:
+                return {clave: datos[clave] for clave in datos.files}
+        except (OSError, ValueError):
+            pass
+    arreglos = calcular()
+    if ruta:
+        temporal = f"{ruta}.{os.getpid()}.tmp.npz"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+            np.savez(temporal, **arreglos)
+            os.replace(temporal, ruta)
+        except OSError:
+            pass
+    return arreglos
@@ -0,0 +1,99 @@
+import numpy as np
+from scipy.spatial import KDTree
+
+# Metros por grado de latitud, el mismo valor que usa el mapa para dibujar círculos.
+METROS_POR_GRADO = 111320.0
+CANDIDATOS = 8
+# Los tramos largos se indexan por piezas de a lo sumo este largo, para que el radio de búsqueda sea pequeño.
+LARGO_PIEZA_M = 50.0
+
+
+class Enganche:
+    # Proyección de cada punto sobre su tramo de calle más cercano: el punto queda en
+    # a + t × (b - a), y las aristas a→b / b→a valen -1 si la calle no admite ese sentido.
+    def __init__(self, a, b, t, distancia, lat, lon, arista_ida, arista_vuelta):
+        self.a, self.b, self.t, self.distancia = a, b, t, distancia
+        self.lat, self.lon = lat, lon
+        self.arista_ida, self.arista_vuelta = arista_ida, arista_vuelta
+
+    def __len__(self):
+        return len(self.t)
+
+
+class IndiceEspacial:
+    def __init__(self, grafo):
+        self.grafo = grafo
+        self.lat0 = float(np.mean(grafo.lat))
+        self.escala_lon = np.cos(np.radians(self.lat0))
+        self.xy_nodos = self.proyectar(grafo.lat, grafo.lon)
+        self.kd_tree_nodos = KDTree(self.xy_nodos)
+
+        # Un tramo por par de nodos unidos por alguna calle, en cualquier sentido.
+        u = grafo.origenes(grafo.indptr_nd)
+        v = grafo.indices_nd
+        tramo = u < v
+        self.a, self.b = u[tramo].astype(np.int64), v[tramo].astype(np.int64)
+        self.arista_ida = grafo.indice_arista(self.a, self.b)
+        self.arista_vuelta = grafo.indice_arista(self.b, self.a)
+        p, q = self.xy_nodos[self.a], self.xy_nodos[self.b]
+        self.inicio, self.delta = p, q - p
+        self.largo2 = np.einsum('ij,ij->i', self.delta, self.delta)
+        # Índice cargado de una vez sobre los puntos medios de las piezas; el radio acota el error de usar el punto medio.
+        piezas = np.maximum(np.ceil(np.sqrt(self.largo2) / LARGO_PIEZA_M), 1).astype(np.int64)
+        self.tramo_de_pieza = np.repeat(np.arange(len(self.a)), piezas)
+        fraccion = (np.arange(piezas.sum()) - np.repeat(np.cumsum(piezas) - piezas, piezas) + 0.5) / piezas[self.tramo_de_pieza]
+        medios = p[self.tramo_de_pieza] + fraccion[:, None] * self.delta[self.tramo_de_pieza]
+        self.kd_tree_tramos = KDTree(medios, balanced_tree=True)
+        self.radio = float(np.max(np.sqrt(self.largo2) / piezas) / 2) if len(piezas) else 0.0
+
+    def proyectar(self, lat, lon):
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        return np.column_stack([lon * self.escala_lon * METROS_POR_GRADO, lat * METROS_POR_GRADO])
+
+    def nodos_cercanos(self, lats, lons):
+        _, indices = self.kd_tree_nodos.query(self.proyectar(lats, lons))
+        return indices
+
+    def _distancias(self, xy, tramos):
+        # xy: (N, 2); tramos: (N, k). Devuelve t y distancia al cuadrado de cada par punto-tramo.
+        relativo = xy[:, None, :] - self.inicio[tramos]
+        largo2 = self.largo2[tramos]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.clip(np.einsum('nkj,nkj->nk', relativo, self.delta[tramos]) / largo2, 0.0, 1.0)
+        t = np.where(largo2 > 0, t, 0.0)
+        diferencia = relativo - t[..., None] * self.delta[tramos]
+        return t, np.einsum('nkj,nkj->nk', diferencia, diferencia)
+
+    def _mejores(self, xy, k):
+        distancia_medio, piezas = self.kd_tree_tramos.query(xy, k=k)
+        tramos = self.tramo_de_pieza[piezas.reshape(len(xy), k)]
+        t, distancia2 = self._distancias(xy, tramos)
+        mejor = np.argmin(distancia2, axis=1)
+        filas = np.arange(len(xy))
+        distancia = np.sqrt(distancia2[filas, mejor])
+        # Un tramo fuera de los k candidatos está al menos a (distancia al k-ésimo punto medio - radio).
+        dudosos = distancia > distancia_medio.reshape(len(xy), k)[:, -1] - self.radio
+        return tramos[filas, mejor], t[filas, mejor], distancia, dudosos
+
+    def enganchar(self, lats, lons):
+        xy = self.proyectar(lats, lons)
+        total_piezas = len(self.tramo_de_pieza)
+        tramo, t, distancia, dudosos = self._mejores(xy, min(CANDIDATOS, total_piezas))
+        dudosos = np.flatnonzero(dudosos)
+        if len(dudosos):
+            # Puntos lejos de toda calle: primero se amplían los candidatos en bloque.
+            tramo[dudosos], t[dudosos], distancia[dudosos], siguen = self._mejores(xy[dudosos], min(8 * CANDIDATOS, total_piezas))
+            dudosos = dudosos[siguen]
+        for i in dudosos:
+            candidatos = np.unique(self.tramo_de_pieza[self.kd_tree_tramos.query_ball_point(xy[i], distancia[i] + self.radio)])
+            if len(candidatos) == 0:
+                continue
+            t_i, distancia2_i = self._distancias(xy[i:i + 1], candidatos[None, :])
+            j = int(np.argmin(distancia2_i[0]))
+            tramo[i], t[i], distancia[i] = candidatos[j], t_i[0, j], np.sqrt(distancia2_i[0, j])
+
+        lat_a, lon_a = self.grafo.lat[self.a[tramo]], self.grafo.lon[self.a[tramo]]
+        lat_b, lon_b = self.grafo.lat[self.b[tramo]], self.grafo.lon[self.b[tramo]]
+        return Enganche(self.a[tramo], self.b[tramo], t, distancia,
+                        lat_a + t * (lat_b - lat_a), lon_a + t * (lon_b - lon_a),
+                        self.arista_ida[tramo], self.arista_vuelta[tramo])
@@ -0,0 +1,103 @@
+import json
+import os
+
+import numpy as np
+
+from grafo import hash_entradas, npz_en_cache
+from indice_espacial import METROS_POR_GRADO
+from servicio_datos import DIRECTORIO_CACHE
+
+RUTA_GEOJSON = "peru_distrital_simple.geojson"
+# Formato del .npz de límites; se incrementa al cambiar lo que se guarda (independiente de VERSION_CACHE del grafo).
+VERSION_LIMITES = 1
+PROVINCIA = "LIMA"
+DISTRITOS_DE_INTERES = ("SAN ISIDRO", "MIRAFLORES", "SURQUILLO", "SAN BORJA", "BARRANCO", "SANTIAGO DE SURCO")
+# (zoom mínimo, tolerancia en metros) de cada nivel de detalle, del más fino al más grueso.
+# La tolerancia es del orden de un píxel del mapa en Lima a ese zoom; 0 conserva todos los vértices.
+NIVELES = ((16, 0.0), (14, 4.0), (12, 16.0), (0, 64.0))
+
+
+def douglas_peucker(xy, tolerancia):
+    # Máscara de los vértices que se conservan; los extremos siempre se conservan.
+    conservar = np.zeros(len(xy), dtype=bool)
+    conservar[[0, -1]] = True
+    if tolerancia <= 0:
+        conservar[:] = True
+        return conservar
+    pendientes = [(0, len(xy) - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+        p, delta = xy[inicio], xy[fin] - xy[inicio]
+        relativo = xy[inicio + 1:fin] - p
+        largo2 = delta @ delta
+        if largo2 > 0:
+            # Distancia al segmento (no a la recta), para que los anillos cerrados funcionen igual.
+            t = np.clip(relativo @ delta / largo2, 0.0, 1.0)
+            relativo = relativo - t[:, None] * delta
+        distancia2 = np.einsum('ij,ij->i', relativo, relativo)
+        peor = int(np.argmax(distancia2))
+        if distancia2[peor] > tolerancia ** 2:
+            medio = inicio + 1 + peor
+            conservar[medio] = True
+            pendientes.append((inicio, medio))
+            pendientes.append((medio, fin))
+    return conservar
+
+
+def extraer_anillos(geojson_path=RUTA_GEOJSON, distritos=DISTRITOS_DE_INTERES, provincia=PROVINCIA):
+    # Anillo exterior de cada polígono de los distritos pedidos, como arreglos (lat, lon).
+    with open(geojson_path, "r", encoding="utf-8") as f:
+        datos = json.load(f)
+    anillos = []
+    for feature in datos['features']:
+        properties = feature.get('properties') or {}
+        if properties.get('NOMBPROV', '').upper() != provincia or properties.get('NOMBDIST', '').upper() not in distritos:
+            continue
+        geometria = feature.get('geometry')
+        if not geometria: continue
+        poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria.get('coordinates', [])
+        for poligono in poligonos:
+            exterior = np.asarray(poligono[0], dtype=np.float64)
+            if len(exterior) > 1:
+                anillos.append(exterior[:, ::-1].copy())
+    return anillos
+
+
+def simplificar_anillos(anillos, niveles=NIVELES):
+    lat0 = np.mean(np.concatenate(anillos)[:, 0]) if anillos else 0.0
+    escala = np.array([METROS_POR_GRADO, METROS_POR_GRADO * np.cos(np.radians(lat0))])
+    arreglos = {'zoom_minimo': np.array([zoom for zoom, _ in niveles], dtype=np.int64)}
+    for i, (_, tolerancia) in enumerate(niveles):
+        simplificados = [anillo[douglas_peucker(anillo * escala, tolerancia)] for anillo in anillos]
+        arreglos[f'coordenadas_{i}'] = np.concatenate(simplificados) if simplificados else np.zeros((0, 2))
+        arreglos[f'inicio_{i}'] = np.concatenate([[0], np.cumsum([len(a) for a in simplificados])]).astype(np.int64)
+    return arreglos
+
+
+class CapaLimites:
+    # Límites distritales ya recortados y simplificados; cada nivel guarda todos los anillos
+    # en un solo arreglo de coordenadas más los desplazamientos donde empieza cada uno.
+    def __init__(self, arreglos):
+        self.zoom_minimo = arreglos['zoom_minimo']
+        self.coordenadas = [arreglos[f'coordenadas_{i}'] for i in range(len(self.zoom_minimo))]
+        self.inicio = [arreglos[f'inicio_{i}'] for i in range(len(self.zoom_minimo))]
+
+    def nivel(self, zoom):
+        # Primer nivel (el más fino) cuyo zoom mínimo alcanza el zoom actual.
+        return int(np.argmax(self.zoom_minimo <= round(zoom)))
+
+    def anillos(self, nivel):
+        coordenadas, inicio = self.coordenadas[nivel], self.inicio[nivel]
+        return [list(map(tuple, coordenadas[a:b].tolist())) for a, b in zip(inicio[:-1], inicio[1:])]
+
+
+def cargar_limites(geojson_path=RUTA_GEOJSON, directorio_cache=DIRECTORIO_CACHE):
+    # El GeoJSON nacional sólo se lee cuando cambia él, los distritos elegidos o los niveles de detalle;
+    # después basta el .npz de los seis distritos.
+    clave = hash_entradas(geojson_path, version=VERSION_LIMITES,
+                          parametros=(PROVINCIA, sorted(DISTRITOS_DE_INTERES), NIVELES))
+    ruta = os.path.join(directorio_cache, f"limites_{clave}.npz")
+    return CapaLimites(npz_en_cache(ruta, lambda: simplificar_anillos(
+        extraer_anillos(geojson_path, DISTRITOS_DE_INTERES, PROVINCIA), NIVELES)))
@@ -0,0 +1,132 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from grafo import cargar_grafo
+from servicio_datos import RUTA_ARISTAS, RUTA_NODOS, RUTA_PUNTOS, DIRECTORIO_CACHE, obtener_servicio
+
+TAMANO_BLOQUE = 50_000
+_motor = None
+
+
+class MotorLote:
+    # Todo lo que necesita un proceso para rutear orígenes sin interfaz gráfica; las estructuras
+    # salen del servicio de datos del proceso, así que se comparten con la interfaz si ya están cargadas.
+    def __init__(self, servicio):
+        self.grafo = servicio.grafo
+        self.indice_espacial = servicio.indice_espacial
+        self.enganche_seguros = servicio.enganche_seguros
+        self.campo = servicio.campo_evacuacion
+        # El nombre vacío al final corresponde al destino -1 (sin ruta).
+        self.nombres_puntos = np.array([p["nombre"] for p in servicio.puntos_seguros] + [""], dtype=object)
+        self._coordenadas_wkt = [f"{lon:.7f} {lat:.7f}" for lat, lon in zip(self.grafo.lat.tolist(), self.grafo.lon.tolist())]
+
+    def geometria(self, lat, lon, nodo):
+        ruta = self.campo.ruta(nodo)
+        if not ruta:
+            return ""
+        destino = self.campo.destino[nodo]
+        puntos = [f"{lon:.7f} {lat:.7f}"] + [self._coordenadas_wkt[i] for i in ruta]
+        puntos.append(f"{self.enganche_seguros.lon[destino]:.7f} {self.enganche_seguros.lat[destino]:.7f}")
+        return "LINESTRING (" + ", ".join(puntos) + ")"
+
+    def rutear(self, ids, lats, lons, con_geometria=False):
+        enganche = self.indice_espacial.enganchar(lats, lons)
+        nodos, costos, longitudes = self.campo.salida(enganche)
+        alcanzado = np.isfinite(costos)
+        destino = np.where(alcanzado, self.campo.destino[nodos], -1)
+        resultado = pd.DataFrame({
+            'origen': ids,
+            'lat': lats,
+            'lon': lons,
+            'nodo': self.grafo.ids[nodos],
+            'distancia_enganche_m': enganche.distancia,
+            'punto_seguro': self.nombres_puntos[destino],
+            'costo_min': np.where(alcanzado, costos, np.nan),
+            'longitud_m': np.where(alcanzado, longitudes, np.nan),
+            'saltos': np.where(alcanzado, self.campo.saltos[nodos], -1),
+        })
+        if con_geometria:
+            resultado['geometria'] = [self.geometria(lat, lon, nodo) if ok else ""
+                                      for lat, lon, nodo, ok in zip(enganche.lat.tolist(), enganche.lon.tolist(), nodos.tolist(), alcanzado.tolist())]
+        return resultado
+
+
+def _inicializar_trabajador(nodos_path, aristas_path, puntos_path, directorio_cache):
+    global _motor
+    _motor = MotorLote(obtener_servicio(nodos_path, aristas_path, puntos_path, directorio_cache))
+
+
+def _rutear_bloque(ids, lats, lons, con_geometria):
+    return _motor.rutear(ids, lats, lons, con_geometria)
+
+
+def leer_origenes(origenes_path, tamano_bloque=TAMANO_BLOQUE):
+    # Sin columna id, el origen es el número de fila del CSV (el índice corrido del lector por bloques),
+    # tomado antes de descartar filas sin coordenadas para que siga coincidiendo con la entrada.
+    for bloque in pd.read_csv(origenes_path, chunksize=tamano_bloque):
+        bloque = bloque.dropna(subset=['lat', 'lon'])
+        ids = bloque['id'].to_numpy() if 'id' in bloque else bloque.index.to_numpy()
+        yield ids, bloque['lat'].to_numpy(dtype=np.float64), bloque['lon'].to_numpy(dtype=np.float64)
+
+
+class EscritorResultados:
+    def __init__(self, salida_path):
+        self.salida_path = salida_path
+        self.parquet = salida_path.lower().endswith(".parquet")
+        self.escritor = None
+        self.filas = 0
+
+    def escribir(self, resultado):
+        if self.parquet:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ImportError("Para escribir resultados en Parquet se necesita instalar pyarrow.") from e
+            tabla = pa.Table.from_pandas(resultado, preserve_index=False)
+            if self.escritor is None:
+                self.escritor = pq.ParquetWriter(self.salida_path, tabla.schema)
+            self.escritor.write_table(tabla)
+        else:
+            resultado.to_csv(self.salida_path, mode="w" if self.filas == 0 else "a", header=self.filas == 0, index=False)
+        self.filas += len(resultado)
+
+    def cerrar(self):
+        if self.escritor is not None:
+            self.escritor.close()
+
+
+def rutear_lote(origenes_path, salida_path, procesos=None, tamano_bloque=TAMANO_BLOQUE, con_geometria=False,
+                nodos_path=RUTA_NODOS, aristas_path=RUTA_ARISTAS, puntos_path=RUTA_PUNTOS,
+                directorio_cache=DIRECTORIO_CACHE, al_progresar=None):
+    procesos = procesos or os.cpu_count() or 1
+    argumentos = (nodos_path, aristas_path, puntos_path, directorio_cache)
+    escritor = EscritorResultados(salida_path)
+    try:
+        if procesos == 1:
+            _inicializar_trabajador(*argumentos)
+            for ids, lats, lons in leer_origenes(origenes_path, tamano_bloque):
+                escritor.escribir(_rutear_bloque(ids, lats, lons, con_geometria))
+                if al_progresar: al_progresar(escritor.filas)
+            return escritor.filas
+
+        # Se compila la caché antes de crear el pool para que los procesos sólo la mapeen en memoria.
+        cargar_grafo(nodos_path, aristas_path, directorio_cache)
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_trabajador, initargs=argumentos) as pool:
+            # Pocos bloques en vuelo y escritura en orden: la memoria no depende del número de orígenes.
+            pendientes = deque()
+            for ids, lats, lons in leer_origenes(origenes_path, tamano_bloque):
+                pendientes.append(pool.submit(_rutear_bloque, ids, lats, lons, con_geometria))
+                if len(pendientes) >= 2 * procesos:
+                    escritor.escribir(pendientes.popleft().result())
+                    if al_progresar: al_progresar(escritor.filas)
+            while pendientes:
+                escritor.escribir(pendientes.popleft().result())
+                if al_progresar: al_progresar(escritor.filas)
+        return escritor.filas
+    finally:
+        escritor.cerrar()
@@ -0,0 +1,372 @@
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from indice_espacial import METROS_POR_GRADO, Enganche
+from rutas import INTERVALO_CANCELACION, BusquedaCancelada, costos_por_nodo
+
+# Cambia cuando cambia el formato de las celdas: un directorio con otra versión se reconstruye.
+VERSION_PARTICIONES = 1
+TAMANO_CELDA_M = 2000.0
+# Celdas completas que se mantienen abiertas a la vez; las demás se vuelven a mapear si se necesitan.
+CELDAS_EN_MEMORIA = 64
+MANIFIESTO = "manifiesto.json"
+GLOBALES = ("celda_de_nodo", "local_de_nodo", "indice_frontera", "frontera", "codigos",
+            "overlay_indptr", "overlay_indices", "overlay_pesos", "overlay_celda")
+# Cada celda guarda su subgrafo y los tramos de calle que tocan alguno de sus nodos, para enganchar
+# puntos sin el índice espacial global. Un sentido no permitido tiene peso infinito.
+POR_CELDA = ("ids", "lat", "lon", "indptr", "indices", "pesos",
+             "tramo_a", "tramo_b", "tramo_lat_a", "tramo_lon_a", "tramo_lat_b", "tramo_lon_b",
+             "tramo_peso_ida", "tramo_peso_vuelta")
+
+
+def directorio_particiones(clave, directorio_cache, tamano_celda_m=TAMANO_CELDA_M):
+    # Se identifica por el hash de los CSV, igual que la caché del grafo, para abrirlo sin cargar el grafo.
+    return os.path.join(directorio_cache, f"particiones_{clave}_{int(tamano_celda_m)}m")
+
+
+def leer_manifiesto(directorio):
+    try:
+        with open(os.path.join(directorio, MANIFIESTO), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def particiones_vigentes(directorio, tamano_celda_m=TAMANO_CELDA_M):
+    manifiesto = leer_manifiesto(directorio)
+    return (manifiesto is not None and manifiesto.get('version') == VERSION_PARTICIONES
+            and manifiesto.get('tamano_celda_m') == tamano_celda_m)
+
+
+def _proyectar(lat, lon, escala_lon):
+    # La misma proyección que IndiceEspacial, para que el enganche por celdas coincida con el global.
+    return np.asarray(lon, dtype=np.float64) * escala_lon * METROS_POR_GRADO, np.asarray(lat, dtype=np.float64) * METROS_POR_GRADO
+
+
+def _ruta_celda(directorio, celda, nombre):
+    return os.path.join(directorio, "celdas", f"{celda}_{nombre}.npy")
+
+
+def construir_particiones(grafo, directorio, tamano_celda_m=TAMANO_CELDA_M):
+    # Cada celda guarda sus nodos, sus aristas internas y sus tramos; el overlay une los nodos de frontera con
+    # las aristas que cruzan entre celdas y con atajos que resumen el camino mínimo dentro de cada celda.
+    # grafo (y con él pandas) sólo se importa para construir: abrir particiones ya guardadas no lo necesita.
+    from grafo import a_csr
+    n = grafo.num_nodos
+    lat0 = float(np.mean(grafo.lat))
+    x, y = _proyectar(grafo.lat, grafo.lon, np.cos(np.radians(lat0)))
+    x_min, y_min = float(x.min()), float(y.min())
+    columna = np.floor((x - x_min) / tamano_celda_m).astype(np.int64)
+    fila = np.floor((y - y_min) / tamano_celda_m).astype(np.int64)
+    columnas = int(columna.max()) + 1
+    # Sólo se numeran las celdas de la grilla que tienen nodos; codigos[celda] = fila × columnas + columna.
+    codigos, celda = np.unique(fila * columnas + columna, return_inverse=True)
+    celda = celda.astype(np.int32)
+    num_celdas = len(codigos)
+    orden = np.argsort(celda, kind='stable')
+    inicio = np.zeros(num_celdas + 1, dtype=np.int64)
+    np.cumsum(np.bincount(celda, minlength=num_celdas), out=inicio[1:])
+    local = np.empty(n, dtype=np.int32)
+    local[orden] = np.arange(n) - inicio[celda[orden]]
+
+    u, v, w = grafo.origenes(), np.asarray(grafo.indices), np.asarray(grafo.pesos)
+    interna = celda[u] == celda[v]
+    es_frontera = np.zeros(n, dtype=bool)
+    es_frontera[u[~interna]] = es_frontera[v[~interna]] = True
+    frontera = np.flatnonzero(es_frontera)
+    indice_frontera = np.full(n, -1, dtype=np.int32)
+    indice_frontera[frontera] = np.arange(len(frontera))
+
+    # Tramos como en IndiceEspacial: un par de nodos unidos en algún sentido, con el peso de cada sentido.
+    # Un tramo entre dos celdas se guarda en ambas.
+    a = grafo.origenes(grafo.indptr_nd)
+    b = np.asarray(grafo.indices_nd)
+    es_tramo = a < b
+    a, b = a[es_tramo].astype(np.int64), b[es_tramo].astype(np.int64)
+    ida, vuelta = grafo.indice_arista(a, b), grafo.indice_arista(b, a)
+    peso_ida = np.where(ida >= 0, w[ida], np.inf)
+    peso_vuelta = np.where(vuelta >= 0, w[vuelta], np.inf)
+    largo_maximo = float(np.sqrt((x[a] - x[b]) ** 2 + (y[a] - y[b]) ** 2).max()) if len(a) else 0.0
+    otra_celda = np.flatnonzero(celda[a] != celda[b])
+    tramo_de_entrada = np.concatenate([np.arange(len(a)), otra_celda])
+    celda_de_entrada = np.concatenate([celda[a], celda[b[otra_celda]]])
+    tramo_de_entrada = tramo_de_entrada[np.argsort(celda_de_entrada, kind='stable')]
+    corte_tramos = np.searchsorted(np.sort(celda_de_entrada), np.arange(num_celdas + 1))
+
+    padre = os.path.dirname(os.path.abspath(directorio))
+    os.makedirs(padre, exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=padre)
+    try:
+        os.makedirs(os.path.join(temporal, "celdas"))
+        aristas_internas = np.flatnonzero(interna)
+        aristas_internas = aristas_internas[np.argsort(celda[u[aristas_internas]], kind='stable')]
+        corte = np.searchsorted(celda[u[aristas_internas]], np.arange(num_celdas + 1))
+        atajos = [(indice_frontera[u[~interna]], indice_frontera[v[~interna]], w[~interna], np.full((~interna).sum(), -1, dtype=np.int32))]
+        for t in range(num_celdas):
+            nodos = orden[inicio[t]:inicio[t + 1]]
+            aristas = aristas_internas[corte[t]:corte[t + 1]]
+            tramos = tramo_de_entrada[corte_tramos[t]:corte_tramos[t + 1]]
+            indptr, indices, pesos = a_csr(local[u[aristas]], local[v[aristas]], w[aristas], len(nodos))
+            arreglos = {'ids': nodos, 'lat': np.asarray(grafo.lat)[nodos], 'lon': np.asarray(grafo.lon)[nodos],
+                        'indptr': indptr, 'indices': indices, 'pesos': pesos,
+                        'tramo_a': a[tramos], 'tramo_b': b[tramos],
+                        'tramo_lat_a': np.asarray(grafo.lat)[a[tramos]], 'tramo_lon_a': np.asarray(grafo.lon)[a[tramos]],
+                        'tramo_lat_b': np.asarray(grafo.lat)[b[tramos]], 'tramo_lon_b': np.asarray(grafo.lon)[b[tramos]],
+                        'tramo_peso_ida': peso_ida[tramos], 'tramo_peso_vuelta': peso_vuelta[tramos]}
+            for nombre in POR_CELDA:
+                np.save(_ruta_celda(temporal, t, nombre), np.ascontiguousarray(arreglos[nombre]))
+
+            # Atajos entre todos los pares de nodos de frontera de la celda, sin salir de ella.
+            borde = nodos[es_frontera[nodos]]
+            if len(borde) > 1:
+                matriz = csr_matrix((pesos, indices, indptr), shape=(len(nodos), len(nodos)))
+                distancias = dijkstra(matriz, directed=True, indices=local[borde])[:, local[borde]]
+                i, j = np.nonzero(np.isfinite(distancias) & ~np.eye(len(borde), dtype=bool))
+                atajos.append((indice_frontera[borde[i]], indice_frontera[borde[j]], distancias[i, j], np.full(len(i), t, dtype=np.int32)))
+
+        origen, destino, peso, celda_atajo = (np.concatenate(partes) for partes in zip(*atajos))
+        overlay_indptr, overlay_indices, overlay_pesos, overlay_celda = a_csr(origen, destino, peso, len(frontera), celda_atajo)
+        globales = {
+            'celda_de_nodo': celda, 'local_de_nodo': local, 'indice_frontera': indice_frontera, 'frontera': frontera,
+            'codigos': codigos, 'overlay_indptr': overlay_indptr, 'overlay_indices': overlay_indices,
+            'overlay_pesos': overlay_pesos, 'overlay_celda': overlay_celda,
+        }
+        for nombre in GLOBALES:
+            np.save(os.path.join(temporal, f"{nombre}.npy"), np.ascontiguousarray(globales[nombre]))
+        manifiesto = {'version': VERSION_PARTICIONES, 'tamano_celda_m': tamano_celda_m, 'lat0': lat0,
+                      'x_min': x_min, 'y_min': y_min, 'columnas': columnas, 'largo_maximo_m': largo_maximo}
+        with open(os.path.join(temporal, MANIFIESTO), "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f)
+        os.replace(temporal, directorio)
+    except OSError:
+        shutil.rmtree(temporal, ignore_errors=True)
+        # Otro proceso pudo terminar de construir el mismo directorio antes.
+        if not particiones_vigentes(directorio, tamano_celda_m):
+            raise
+
+
+class Celda:
+    # Subgrafo de una celda mapeado desde disco; las listas para la búsqueda se crean al abrirla.
+    def __init__(self, directorio, numero):
+        for nombre in POR_CELDA:
+            setattr(self, nombre, np.load(_ruta_celda(directorio, numero, nombre), mmap_mode='r'))
+        self.ids_lista = self.ids.tolist()
+        self.indptr_lista = self.indptr.tolist()
+        self.indices_lista = self.indices.tolist()
+        self.pesos_lista = self.pesos.tolist()
+        self._matriz = None
+
+    def matriz(self):
+        if self._matriz is None:
+            n = len(self.ids)
+            self._matriz = csr_matrix((np.asarray(self.pesos), np.asarray(self.indices), np.asarray(self.indptr)), shape=(n, n))
+        return self._matriz
+
+
+class GrafoParticionado:
+    # Búsqueda en dos niveles: las celdas del origen y de los objetivos se recorren completas;
+    # el resto de la red sólo a través del overlay de nodos de frontera.
+    def __init__(self, directorio, celdas_en_memoria=CELDAS_EN_MEMORIA, temporal=None):
+        self.directorio = directorio
+        # Directorio temporal (tempfile.TemporaryDirectory) que se borra junto con el almacén, si lo hay.
+        self._temporal = temporal
+        self.manifiesto = leer_manifiesto(directorio)
+        for nombre in GLOBALES:
+            setattr(self, nombre, np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode='r'))
+        self.num_celdas = len(self.codigos)
+        self.tamano_celda_m = self.manifiesto['tamano_celda_m']
+        self.escala_lon = np.cos(np.radians(self.manifiesto['lat0']))
+        self.columnas = self.manifiesto['columnas']
+        self.filas = int(self.codigos[-1]) // self.columnas + 1 if self.num_celdas else 0
+        self.celdas_en_memoria = celdas_en_memoria
+        self._celdas = OrderedDict()
+        self._celdas_lock = threading.Lock()
+        self.celdas_abiertas = 0
+
+    def celda(self, numero):
+        # Caché LRU de celdas abiertas; la usan el hilo de carga y el de búsqueda.
+        with self._celdas_lock:
+            if numero in self._celdas:
+                self._celdas.move_to_end(numero)
+                return self._celdas[numero]
+            celda = self._celdas[numero] = Celda(self.directorio, numero)
+            self.celdas_abiertas += 1
+            if len(self._celdas) > self.celdas_en_memoria:
+                self._celdas.popitem(last=False)
+            return celda
+
+    def _celdas_alrededor(self, fila, columna, radio):
+        # Celdas con nodos en el cuadrado de (2 × radio + 1)² celdas centrado en (fila, columna).
+        filas = np.arange(max(fila - radio, 0), min(fila + radio, self.filas - 1) + 1)
+        columnas = np.arange(max(columna - radio, 0), min(columna + radio, self.columnas - 1) + 1)
+        buscados = (filas[:, None] * self.columnas + columnas[None, :]).ravel()
+        posicion = np.searchsorted(self.codigos, buscados)
+        existe = posicion < self.num_celdas
+        existe[existe] = self.codigos[posicion[existe]] == buscados[existe]
+        return posicion[existe].tolist()
+
+    def _enganchar_punto(self, x, y):
+        # Tramo más cercano abriendo sólo las celdas vecinas. Un tramo a distancia d tiene sus dos extremos
+        # a menos de d + largo máximo, así que basta con que eso quede dentro del cuadrado revisado.
+        fila = int(np.floor((y - self.manifiesto['y_min']) / self.tamano_celda_m))
+        columna = int(np.floor((x - self.manifiesto['x_min']) / self.tamano_celda_m))
+        radio = 1
+        while True:
+            mejor = None
+            for numero in self._celdas_alrededor(fila, columna, radio):
+                celda = self.celda(numero)
+                if len(celda.tramo_a) == 0:
+                    continue
+                xa, ya = _proyectar(celda.tramo_lat_a, celda.tramo_lon_a, self.escala_lon)
+                xb, yb = _proyectar(celda.tramo_lat_b, celda.tramo_lon_b, self.escala_lon)
+                dx, dy = xb - xa, yb - ya
+                rx, ry = x - xa, y - ya
+                largo2 = dx * dx + dy * dy
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    t = np.clip((rx * dx + ry * dy) / largo2, 0.0, 1.0)
+                t = np.where(largo2 > 0, t, 0.0)
+                distancia2 = (rx - t * dx) ** 2 + (ry - t * dy) ** 2
+                k = int(np.argmin(distancia2))
+                if mejor is None or distancia2[k] < mejor[0]:
+                    mejor = (float(distancia2[k]), celda, k, float(t[k]))
+            cubre_todo = (fila - radio <= 0 and fila + radio >= self.filas - 1
+                          and columna - radio <= 0 and columna + radio >= self.columnas - 1)
+            if cubre_todo or (mejor is not None and np.sqrt(mejor[0]) <= radio * self.tamano_celda_m - self.manifiesto['largo_maximo_m']):
+                return mejor
+            radio += 1
+
+    def enganchar(self, lats, lons):
+        # Como IndiceEspacial.enganchar, pero las aristas de ida/vuelta del resultado indexan el arreglo de
+        # pesos que se devuelve junto con el enganche (no el del grafo completo).
+        x, y = _proyectar(lats, lons, self.escala_lon)
+        campos = {nombre: [] for nombre in ('a', 'b', 't', 'distancia', 'lat', 'lon')}
+        pesos = []
+        for xi, yi in zip(x.tolist(), y.tolist()):
+            distancia2, celda, k, t = self._enganchar_punto(xi, yi)
+            lat_a, lat_b = float(celda.tramo_lat_a[k]), float(celda.tramo_lat_b[k])
+            lon_a, lon_b = float(celda.tramo_lon_a[k]), float(celda.tramo_lon_b[k])
+            for nombre, valor in (('a', int(celda.tramo_a[k])), ('b', int(celda.tramo_b[k])), ('t', t),
+                                  ('distancia', np.sqrt(distancia2)), ('lat', lat_a + t * (lat_b - lat_a)),
+                                  ('lon', lon_a + t * (lon_b - lon_a))):
+                campos[nombre].append(valor)
+            pesos += [float(celda.tramo_peso_ida[k]), float(celda.tramo_peso_vuelta[k])]
+        pesos = np.array(pesos)
+        posicion = np.arange(len(pesos))
+        arista_ida = np.where(np.isfinite(pesos[0::2]), posicion[0::2], -1)
+        arista_vuelta = np.where(np.isfinite(pesos[1::2]), posicion[1::2], -1)
+        enganche = Enganche(np.array(campos['a'], dtype=np.int64), np.array(campos['b'], dtype=np.int64),
+                            np.array(campos['t']), np.array(campos['distancia']),
+                            np.array(campos['lat']), np.array(campos['lon']), arista_ida, arista_vuelta)
+        return enganche, pesos
+
+    def buscar(self, origen, objetivos, cancelacion=None):
+        # Igual que BuscadorCSR.buscar (sin heurística), con índices globales de nodo.
+        objetivos = costos_por_nodo(objetivos)
+        distancias = costos_por_nodo(origen)
+        celda_de_nodo, local_de_nodo, indice_frontera = self.celda_de_nodo, self.local_de_nodo, self.indice_frontera
+        completas = {int(celda_de_nodo[nodo]): None for nodo in list(objetivos) + list(distancias)}
+        for numero in completas:
+            completas[numero] = self.celda(numero)
+        # Para cada nodo: nodo anterior y celda del atajo por el que se llegó (-1 si fue una arista real).
+        predecesores = dict.fromkeys(distancias, (-1, -1))
+        asentados = set()
+        heap = [(costo, nodo) for nodo, costo in distancias.items()]
+        heapq.heapify(heap)
+        asentados_total, relajadas, inserciones = 0, 0, len(heap)
+        resultado = (float('inf'), [])
+        while heap:
+            distancia, u = heapq.heappop(heap)
+            if u < 0:
+                resultado = (distancia, self._desempaquetar(~u, predecesores))
+                break
+            if u in asentados:
+                continue
+            asentados.add(u)
+            asentados_total += 1
+            if cancelacion is not None and asentados_total % INTERVALO_CANCELACION == 0 and cancelacion.is_set():
+                raise BusquedaCancelada()
+            if u in objetivos:
+                if objetivos[u] == 0:
+                    resultado = (distancia, self._desempaquetar(u, predecesores))
+                    break
+                heapq.heappush(heap, (distancia + objetivos[u], ~u))
+
+            celda = completas.get(int(celda_de_nodo[u]))
+            vecinos = []
+            if celda is not None:
+                lu = int(local_de_nodo[u])
+                inicio, fin = celda.indptr_lista[lu], celda.indptr_lista[lu + 1]
+                ids = celda.ids_lista
+                vecinos = [(ids[v], w, -1) for v, w in zip(celda.indices_lista[inicio:fin], celda.pesos_lista[inicio:fin])]
+            f = int(indice_frontera[u])
+            if f >= 0:
+                inicio, fin = int(self.overlay_indptr[f]), int(self.overlay_indptr[f + 1])
+                por_atajo = self.overlay_celda[inicio:fin].tolist()
+                destinos = self.frontera[self.overlay_indices[inicio:fin]].tolist()
+                for v, w, atajo in zip(destinos, self.overlay_pesos[inicio:fin].tolist(), por_atajo):
+                    # En una celda completa los atajos sobran: sus aristas ya están en la búsqueda.
+                    if atajo < 0 or celda is None:
+                        vecinos.append((v, w, atajo))
+            relajadas += len(vecinos)
+            for v, w, atajo in vecinos:
+                nueva = distancia + w
+                if v not in asentados and nueva < distancias.get(v, float('inf')):
+                    distancias[v] = nueva
+                    predecesores[v] = (u, atajo)
+                    heapq.heappush(heap, (nueva, v))
+                    inserciones += 1
+        return resultado + ({'nodos_asentados': asentados_total, 'aristas_relajadas': relajadas,
+                             'inserciones_heap': inserciones, 'celdas_completas': len(completas)},)
+
+    def _desempaquetar(self, destino, predecesores):
+        # Reemplaza cada atajo por el camino mínimo dentro de su celda.
+        ruta = [destino]
+        while predecesores[ruta[-1]][0] >= 0:
+            anterior, atajo = predecesores[ruta[-1]]
+            if atajo >= 0:
+                ruta.extend(self._camino_en_celda(atajo, anterior, ruta[-1])[::-1][1:-1])
+            ruta.append(anterior)
+        return ruta[::-1]
+
+    def _camino_en_celda(self, numero, desde, hasta):
+        celda = self.celda(numero)
+        inicio, fin = int(self.local_de_nodo[desde]), int(self.local_de_nodo[hasta])
+        _, predecesor = dijkstra(celda.matriz(), directed=True, indices=inicio, return_predecessors=True)
+        camino = [fin]
+        while camino[-1] != inicio:
+            camino.append(int(predecesor[camino[-1]]))
+        return [celda.ids_lista[i] for i in camino[::-1]]
+
+    def coordenadas(self, ruta):
+        # Coordenadas de una ruta leyendo sólo las celdas por las que pasa.
+        puntos = []
+        for nodo in ruta:
+            celda = self.celda(int(self.celda_de_nodo[nodo]))
+            local = int(self.local_de_nodo[nodo])
+            puntos.append((float(celda.lat[local]), float(celda.lon[local])))
+        return puntos
+
+
+def cargar_particiones(directorio, obtener_grafo, tamano_celda_m=TAMANO_CELDA_M):
+    # Abre las particiones sin tocar el grafo completo; obtener_grafo sólo se llama si faltan o son de otra versión.
+    if particiones_vigentes(directorio, tamano_celda_m):
+        return GrafoParticionado(directorio)
+    shutil.rmtree(directorio, ignore_errors=True)
+    grafo = obtener_grafo()
+    try:
+        construir_particiones(grafo, directorio, tamano_celda_m)
+        return GrafoParticionado(directorio)
+    except OSError:
+        # Caché no escribible: las celdas viven en un directorio temporal que se borra con el almacén.
+        temporal = tempfile.TemporaryDirectory()
+        construir_particiones(grafo, os.path.join(temporal.name, "particiones"), tamano_celda_m)
+        return GrafoParticionado(os.path.join(temporal.name, "particiones"), temporal=temporal)
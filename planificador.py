@@ -0,0 +1,118 @@
+import threading
+import time
+import tkinter
+from collections import deque
+from queue import Queue, Empty
+
+import trazas
+
+# Latencias recientes que se guardan para las métricas.
+HISTORIAL_LATENCIAS = 100
+
+
+class ColaTk(Queue):
+    # Cola de tareas hacia el hilo de Tk: cada put genera un evento virtual en el widget,
+    # de modo que la tarea se ejecuta en cuanto llega en lugar de esperar a un sondeo.
+    EVENTO = "<<TareaPendiente>>"
+
+    def __init__(self, widget):
+        super().__init__()
+        self.widget = widget
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        try:
+            self.widget.event_generate(self.EVENTO, when="tail")
+        except (tkinter.TclError, RuntimeError):
+            # El widget ya fue destruido o el bucle principal terminó.
+            pass
+
+    def vaciar(self):
+        while True:
+            try:
+                task, args = self.get_nowait()
+            except Empty:
+                return
+            task(*args)
+
+
+class SolicitudRuta:
+    def __init__(self, lat, lon):
+        self.lat, self.lon = lat, lon
+        self.inicio = time.perf_counter()
+        # Se activa cuando llega un clic más nuevo: la búsqueda en curso se detiene y su resultado se descarta.
+        self.cancelacion = threading.Event()
+        # Traza de la búsqueda; el dibujo en Tk la completa y la cierra.
+        self.traza = trazas.NULO
+
+    @property
+    def vigente(self):
+        return not self.cancelacion.is_set()
+
+
+class PlanificadorRutas:
+    # Un único hilo calcula las rutas. La cola guarda a lo sumo una solicitud pendiente:
+    # cada clic reemplaza a la anterior y cancela la que se esté calculando.
+    def __init__(self, calcular):
+        self._calcular = calcular
+        self._cola = Queue(maxsize=1)
+        self._ultima = None
+        self.solicitudes = 0
+        self.descartadas = 0
+        self.canceladas = 0
+        self.latencias = deque(maxlen=HISTORIAL_LATENCIAS)
+        self._hilo = threading.Thread(target=self._ciclo, daemon=True)
+        self._hilo.start()
+
+    def solicitar(self, lat, lon):
+        # Sólo se llama desde el hilo de Tk, así que el vaciado y el put no compiten entre sí.
+        solicitud = SolicitudRuta(lat, lon)
+        self.solicitudes += 1
+        if self._ultima is not None:
+            self._ultima.cancelacion.set()
+        try:
+            self._cola.get_nowait()
+            self.descartadas += 1
+        except Empty:
+            pass
+        self._ultima = solicitud
+        self._cola.put_nowait(solicitud)
+        return solicitud
+
+    def _ciclo(self):
+        while True:
+            solicitud = self._cola.get()
+            if solicitud is None:
+                return
+            if not solicitud.vigente:
+                continue
+            self._calcular(solicitud)
+            if not solicitud.vigente:
+                self.canceladas += 1
+
+    def registrar_dibujo(self, solicitud):
+        # Latencia de extremo a extremo: desde el clic hasta que la ruta quedó dibujada.
+        latencia = time.perf_counter() - solicitud.inicio
+        self.latencias.append(latencia)
+        return latencia
+
+    def metricas(self):
+        latencias = list(self.latencias)
+        return {
+            'profundidad_cola': self._cola.qsize(),
+            'solicitudes': self.solicitudes,
+            'descartadas': self.descartadas,
+            'canceladas': self.canceladas,
+            'latencia_ultima_ms': latencias[-1] * 1000 if latencias else None,
+            'latencia_media_ms': sum(latencias) / len(latencias) * 1000 if latencias else None,
+            'latencia_max_ms': max(latencias) * 1000 if latencias else None,
+        }
+
+    def detener(self):
+        if self._ultima is not None:
+            self._ultima.cancelacion.set()
+        try:
+            self._cola.get_nowait()
+        except Empty:
+            pass
+        self._cola.put_nowait(None)
@@ -0,0 +1,329 @@
+import heapq
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from grafo import arreglos_en_cache
+
+NUM_LANDMARKS = 16
+# Cada cuántos nodos asentados se consulta si la búsqueda fue cancelada.
+INTERVALO_CANCELACION = 256
+
+
+class BusquedaCancelada(Exception):
+    pass
+
+
+def transponer(indptr, indices, pesos, n):
+    origenes = np.repeat(np.arange(n, dtype=np.int32), np.diff(indptr))
+    orden = np.lexsort((origenes, indices))
+    indptr_t = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=n), out=indptr_t[1:])
+    return indptr_t, origenes[orden], np.asarray(pesos)[orden]
+
+
+def matriz_invertida(grafo):
+    n = grafo.num_nodos
+    indptr, indices, pesos = transponer(grafo.indptr, grafo.indices, grafo.pesos, n)
+    return csr_matrix((pesos, indices, indptr), shape=(n, n))
+
+
+def acumular_hacia_destino(sucesor, valores):
+    # Suma los valores a lo largo de la cadena de sucesores duplicando saltos (log de la profundidad).
+    total = np.array(valores, dtype=np.float64)
+    siguiente = np.array(sucesor, dtype=np.int64)
+    activos = np.flatnonzero(siguiente >= 0)
+    while len(activos):
+        total[activos] += total[siguiente[activos]]
+        siguiente[activos] = siguiente[siguiente[activos]]
+        activos = activos[siguiente[activos] >= 0]
+    return total
+
+
+def acumular_desde_hojas(padre, valores):
+    # Suma de los valores de cada subárbol (incluido el propio nodo), procesando de las hojas a la raíz.
+    total = np.array(valores, dtype=np.float64)
+    profundidad = acumular_hacia_destino(padre, padre >= 0).astype(np.int64)
+    orden = np.argsort(-profundidad, kind='stable')
+    cortes = np.flatnonzero(np.diff(profundidad[orden])) + 1
+    for nivel in np.split(orden, cortes):
+        nivel = nivel[profundidad[nivel] > 0]
+        if len(nivel):
+            np.add.at(total, padre[nivel], total[nivel])
+    return total
+
+
+def raices(sucesor):
+    # Último nodo de la cadena de sucesores de cada nodo, duplicando saltos.
+    raiz = np.where(sucesor >= 0, sucesor, np.arange(len(sucesor)))
+    while True:
+        siguiente = raiz[raiz]
+        if np.array_equal(siguiente, raiz):
+            return raiz
+        raiz = siguiente
+
+
+def _entradas(enganche, *valores):
+    # Un punto seguro sobre un tramo a-b se alcanza desde a (si existe a→b) o desde b (si existe b→a),
+    # pagando la fracción del tramo que falta recorrer. Si quedó justo sobre un extremo (t = 0 o 1) está en
+    # ese nodo: se entra sólo por él y sin costo, sea cual sea el sentido o el tramo empatado que tocó.
+    t = enganche.t
+    en_a, en_b = t <= 0, t >= 1
+    ida = ((enganche.arista_ida >= 0) & ~en_b) | en_a
+    vuelta = ((enganche.arista_vuelta >= 0) & ~en_a) | en_b
+    nodos = np.concatenate([enganche.a[ida], enganche.b[vuelta]])
+    puntos = np.concatenate([np.flatnonzero(ida), np.flatnonzero(vuelta)])
+    aristas = np.concatenate([enganche.arista_ida[ida], enganche.arista_vuelta[vuelta]])
+    fracciones = np.concatenate([t[ida], 1 - t[vuelta]])
+    recorre = ~np.concatenate([en_a[ida], en_b[vuelta]])
+    costos = []
+    for valor in valores:
+        costo = np.zeros(len(nodos))
+        costo[recorre] = fracciones[recorre] * np.asarray(valor)[aristas[recorre]]
+        costos.append(costo)
+    return nodos, puntos, costos
+
+
+def entradas_de_enganche(grafo, enganche):
+    nodos, puntos, (costos, longitudes) = _entradas(enganche, grafo.pesos, grafo.longitudes)
+    return nodos, costos, longitudes, puntos
+
+
+def salidas_de_enganche(pesos, enganche, i=0):
+    # Nodos por los que el punto i sale de su tramo (respetando el sentido), con el costo de la fracción recorrida.
+    # pesos es el arreglo que indexan las aristas del enganche (grafo.pesos para IndiceEspacial).
+    t = float(enganche.t[i])
+    if t <= 0 or t >= 1:
+        # Punto justo sobre un nodo: sale por él, sin depender del sentido del tramo que tocó.
+        return {int(enganche.a[i] if t <= 0 else enganche.b[i]): 0.0}
+    salidas = {}
+    ida, vuelta = int(enganche.arista_ida[i]), int(enganche.arista_vuelta[i])
+    if ida >= 0:
+        salidas[int(enganche.b[i])] = (1 - t) * float(pesos[ida])
+    if vuelta >= 0:
+        a = int(enganche.a[i])
+        salidas[a] = min(salidas.get(a, float('inf')), t * float(pesos[vuelta]))
+    return salidas
+
+
+def objetivos_de_enganche(pesos, enganche):
+    # Nodos de entrada a los puntos seguros, en el mismo orden que entradas_de_enganche:
+    # costo final de la entrada más barata de cada nodo y su punto.
+    nodos, puntos, (costos,) = _entradas(enganche, pesos)
+    costo_final, punto_de_nodo = {}, {}
+    for nodo, costo, punto in zip(nodos.tolist(), costos.tolist(), puntos.tolist()):
+        if costo < costo_final.get(nodo, float('inf')):
+            costo_final[nodo], punto_de_nodo[nodo] = costo, punto
+    return costo_final, punto_de_nodo
+
+
+def costos_por_nodo(nodos):
+    # Un nodo o una lista de nodos (costo 0), o un dict nodo -> costo.
+    if isinstance(nodos, dict):
+        return {int(nodo): float(costo) for nodo, costo in nodos.items()}
+    if np.ndim(nodos) == 0:
+        return {int(nodos): 0.0}
+    return dict.fromkeys((int(nodo) for nodo in nodos), 0.0)
+
+
+class CampoEvacuacion:
+    # Para cada nodo: costo al punto seguro más conveniente, cuál es y el siguiente nodo de la ruta.
+    # Los puntos seguros entran como nodos de la red, opcionalmente con un costo inicial
+    # (el tramo de calle entre el nodo y el punto) y con el índice del punto al que corresponden.
+    def __init__(self, grafo, nodos_seguros, costos_iniciales=None, longitudes_iniciales=None, puntos=None):
+        self.grafo = grafo
+        self._sucesor_lista = None
+        n = grafo.num_nodos
+        nodos_seguros = np.asarray(nodos_seguros, dtype=np.int64)
+        costos_iniciales = np.zeros(len(nodos_seguros)) if costos_iniciales is None else np.asarray(costos_iniciales, dtype=np.float64)
+        longitudes_iniciales = np.zeros(len(nodos_seguros)) if longitudes_iniciales is None else np.asarray(longitudes_iniciales, dtype=np.float64)
+        puntos = np.arange(len(nodos_seguros)) if puntos is None else np.asarray(puntos, dtype=np.int64)
+        validos = np.flatnonzero(nodos_seguros >= 0)
+        # Para cada nodo se queda la entrada más barata; en empate, la primera de la lista, como en el recorrido original.
+        orden = validos[np.lexsort((validos, costos_iniciales[validos], nodos_seguros[validos]))]
+        fuentes, primero = np.unique(nodos_seguros[orden], return_index=True)
+        entrada = orden[primero]
+
+        self.costo = np.full(n, np.inf)
+        self.sucesor = np.full(n, -1, dtype=np.int32)
+        self.destino = np.full(n, -1, dtype=np.int32)
+        self.longitud = np.full(n, np.inf)
+        self.saltos = np.full(n, -1, dtype=np.int64)
+        if len(fuentes) == 0:
+            return
+        # Dijkstra sobre el grafo invertido desde un nodo virtual (índice n) unido a cada entrada
+        # con su costo inicial: el predecesor allí es el sucesor en el grafo real.
+        indptr, indices, pesos = transponer(grafo.indptr, grafo.indices, grafo.pesos, n)
+        matriz = csr_matrix((np.concatenate([pesos, costos_iniciales[entrada]]),
+                             np.concatenate([indices, fuentes]).astype(np.int32),
+                             np.append(indptr, indptr[-1] + len(fuentes))), shape=(n + 1, n + 1))
+        costo, predecesor = dijkstra(matriz, directed=True, indices=n, return_predecessors=True)
+        self.costo = costo[:n]
+        predecesor = predecesor[:n]
+        alcanzado = np.isfinite(self.costo)
+        self.sucesor[:] = np.where((predecesor >= 0) & (predecesor < n), predecesor, -1)
+        punto_por_nodo = np.full(n, -1, dtype=np.int64)
+        punto_por_nodo[fuentes] = puntos[entrada]
+        longitud_inicial = np.zeros(n)
+        longitud_inicial[fuentes] = longitudes_iniciales[entrada]
+        self.destino[alcanzado] = punto_por_nodo[raices(self.sucesor)][alcanzado]
+
+        con_sucesor = np.flatnonzero(self.sucesor >= 0)
+        longitud_arista = longitud_inicial * (self.sucesor < 0)
+        longitud_arista[con_sucesor] = grafo.longitudes[grafo.indice_arista(con_sucesor, self.sucesor[con_sucesor])]
+        self.longitud[alcanzado] = acumular_hacia_destino(self.sucesor, longitud_arista)[alcanzado]
+        self.saltos[alcanzado] = acumular_hacia_destino(self.sucesor, self.sucesor >= 0)[alcanzado]
+
+    @classmethod
+    def desde_enganche(cls, grafo, enganche):
+        nodos, costos, longitudes, puntos = entradas_de_enganche(grafo, enganche)
+        return cls(grafo, nodos, costos, longitudes, puntos)
+
+    def salida(self, enganche):
+        # Para puntos sobre tramos: mejor nodo por el que salir (respetando el sentido), su costo total y longitud.
+        grafo = self.grafo
+        ida, vuelta = enganche.arista_ida, enganche.arista_vuelta
+        t = enganche.t
+        costo_ida = np.where(ida >= 0, (1 - t) * grafo.pesos[ida] + self.costo[enganche.b], np.inf)
+        costo_vuelta = np.where(vuelta >= 0, t * grafo.pesos[vuelta] + self.costo[enganche.a], np.inf)
+        por_ida = costo_ida <= costo_vuelta
+        nodo = np.where(por_ida, enganche.b, enganche.a)
+        costo = np.minimum(costo_ida, costo_vuelta)
+        longitud = np.where(por_ida, (1 - t) * grafo.longitudes[ida], t * grafo.longitudes[vuelta])
+        # Un punto justo sobre un extremo sale por ese nodo sin recorrer el tramo.
+        en_nodo = (t <= 0) | (t >= 1)
+        nodo = np.where(en_nodo, np.where(t <= 0, enganche.a, enganche.b), nodo)
+        costo = np.where(en_nodo, self.costo[nodo], costo)
+        longitud = np.where(en_nodo, 0.0, longitud) + self.longitud[nodo]
+        return nodo, costo, longitud
+
+    def ruta(self, indice):
+        if self.destino[indice] < 0:
+            return []
+        if self._sucesor_lista is None:
+            self._sucesor_lista = self.sucesor.tolist()
+        sucesor = self._sucesor_lista
+        ruta = [int(indice)]
+        siguiente = sucesor[ruta[0]]
+        while siguiente >= 0:
+            ruta.append(siguiente)
+            siguiente = sucesor[siguiente]
+        return ruta
+
+
+def matriz_no_dirigida(grafo):
+    n = grafo.num_nodos
+    return csr_matrix((grafo.pesos_nd, grafo.indices_nd, grafo.indptr_nd), shape=(n, n))
+
+
+def seleccionar_landmarks(grafo, cantidad=NUM_LANDMARKS, semilla=0):
+    # Selección por el más lejano: cada landmark maximiza la distancia a los ya elegidos.
+    matriz = matriz_no_dirigida(grafo)
+    # El primer nodo al azar sólo sirve para llegar a un extremo de la red.
+    inicio = int(np.random.default_rng(semilla).integers(grafo.num_nodos))
+    minima = dijkstra(matriz, directed=False, indices=inicio)
+    landmarks = []
+    for _ in range(cantidad):
+        actual = int(np.argmax(np.where(np.isfinite(minima), minima, -1)))
+        landmarks.append(actual)
+        minima = np.minimum(minima, dijkstra(matriz, directed=False, indices=actual))
+    return np.array(landmarks, dtype=np.int64)
+
+
+def cargar_landmarks(grafo, cantidad=NUM_LANDMARKS):
+    def calcular():
+        landmarks = seleccionar_landmarks(grafo, cantidad)
+        # desde[i, v] = d(L_i, v) y hacia[i, v] = d(v, L_i), en float32 para que ocupen la mitad.
+        desde = dijkstra(grafo.matriz(), directed=True, indices=landmarks)
+        hacia = dijkstra(matriz_invertida(grafo), directed=True, indices=landmarks)
+        return {'landmarks': landmarks, 'desde': desde.astype(np.float32), 'hacia': hacia.astype(np.float32)}
+    return HeuristicaALT(**arreglos_en_cache(grafo, f"alt_{cantidad}", calcular))
+
+
+class HeuristicaALT:
+    def __init__(self, landmarks, desde, hacia):
+        self.landmarks = landmarks
+        self.desde = desde
+        self.hacia = hacia
+        finitos = np.concatenate([desde[np.isfinite(desde)], hacia[np.isfinite(hacia)]])
+        # Margen que cubre el redondeo a float32 de las dos distancias que se restan.
+        self.tolerancia = 2.5e-7 * float(finitos.max()) if len(finitos) else 0.0
+
+    def para_objetivos(self, objetivos, elementos_por_bloque=1 << 22):
+        # Cota inferior de la distancia de cada nodo al objetivo más cercano (desigualdad triangular).
+        objetivos = np.asarray(objetivos, dtype=np.int64)
+        n = self.desde.shape[1]
+        # Los temporales miden landmarks × nodos del bloque × objetivos: el bloque se achica con muchos objetivos.
+        tamano_bloque = max(1, elementos_por_bloque // (self.desde.shape[0] * max(len(objetivos), 1)))
+        h = np.empty(n)
+        desde_t = self.desde[:, objetivos].astype(np.float64)[:, None, :]
+        hacia_t = self.hacia[:, objetivos].astype(np.float64)[:, None, :]
+        with np.errstate(invalid='ignore'):
+            for inicio in range(0, n, tamano_bloque):
+                bloque = slice(inicio, min(inicio + tamano_bloque, n))
+                desde_v = self.desde[:, bloque].astype(np.float64)[:, :, None]
+                hacia_v = self.hacia[:, bloque].astype(np.float64)[:, :, None]
+                cotas = np.fmax(desde_t - desde_v, hacia_v - hacia_t)
+                cotas = np.where(np.isnan(cotas), 0.0, cotas).max(axis=0)
+                h[bloque] = cotas.min(axis=1)
+        return np.maximum(h - self.tolerancia, 0.0)
+
+
+def reconstruir(predecesores, nodo):
+    ruta = [nodo]
+    while predecesores[ruta[-1]] >= 0:
+        ruta.append(predecesores[ruta[-1]])
+    return ruta[::-1]
+
+
+class BuscadorCSR:
+    # Dijkstra y A* sobre los arreglos CSR, contando los nodos asentados para comparar ambos.
+    def __init__(self, grafo):
+        self.indptr = grafo.indptr.tolist()
+        self.indices = grafo.indices.tolist()
+        self.pesos = grafo.pesos.tolist()
+
+    def buscar(self, origen, objetivos, heuristica=None, cancelacion=None):
+        # origen y objetivos admiten lo mismo que costos_por_nodo: con costos, la búsqueda parte de varios nodos
+        # y cobra al llegar el tramo que falta hasta el punto (la heurística debe ser para esos objetivos).
+        # cancelacion: threading.Event opcional; si se activa, la búsqueda termina con BusquedaCancelada.
+        indptr, indices, pesos = self.indptr, self.indices, self.pesos
+        objetivos = costos_por_nodo(objetivos)
+        h = heuristica.tolist() if isinstance(heuristica, np.ndarray) else heuristica
+        distancias = costos_por_nodo(origen)
+        predecesores = dict.fromkeys(distancias, -1)
+        asentados = set()
+        heap = [(costo + h[nodo] if h is not None else costo, costo, nodo) for nodo, costo in distancias.items()]
+        heapq.heapify(heap)
+        # Contadores en enteros locales: el diccionario de estadísticas se arma una sola vez al terminar.
+        asentados_total, relajadas, inserciones = 0, 0, len(heap)
+        resultado = (float('inf'), [])
+        while heap:
+            _, distancia, u = heapq.heappop(heap)
+            if u < 0:
+                # Llegada a un punto seguro por el objetivo ~u, ya con su costo final.
+                resultado = (distancia, reconstruir(predecesores, ~u))
+                break
+            if u in asentados:
+                continue
+            asentados.add(u)
+            asentados_total += 1
+            if cancelacion is not None and asentados_total % INTERVALO_CANCELACION == 0 and cancelacion.is_set():
+                raise BusquedaCancelada()
+            if u in objetivos:
+                if objetivos[u] == 0:
+                    resultado = (distancia, reconstruir(predecesores, u))
+                    break
+                heapq.heappush(heap, (distancia + objetivos[u], distancia + objetivos[u], ~u))
+            inicio, fin = indptr[u], indptr[u + 1]
+            relajadas += fin - inicio
+            for i in range(inicio, fin):
+                v = indices[i]
+                nueva = distancia + pesos[i]
+                if v not in asentados and nueva < distancias.get(v, float('inf')):
+                    distancias[v] = nueva
+                    predecesores[v] = u
+                    heapq.heappush(heap, (nueva + h[v] if h is not None else nueva, nueva, v))
+                    inserciones += 1
+        return resultado + ({'nodos_asentados': asentados_total, 'aristas_relajadas': relajadas, 'inserciones_heap': inserciones},)
@@ -0,0 +1,198 @@
+import threading
+
+import trazas
+
+# Este módulo no importa numpy, pandas ni scipy al cargarse: el menú debe aparecer sin esperar esas bibliotecas.
+# Las rutas por defecto de los datos viven aquí por la misma razón; grafo.py las reutiliza.
+RUTA_NODOS = "nodos_lima.csv"
+RUTA_ARISTAS = "calles_lima_con_vulnerabilidad.csv"
+RUTA_PUNTOS = "puntos_seguros.csv"
+DIRECTORIO_CACHE = "cache"
+
+_servicios = {}
+_servicios_lock = threading.Lock()
+
+
+class ServicioDatos:
+    # Estructuras inmutables compartidas por todas las vistas y procesos: se construyen una vez,
+    # la primera vez que alguien las pide, y después sólo se leen.
+    def __init__(self, nodos_path=RUTA_NODOS, aristas_path=RUTA_ARISTAS, puntos_path=RUTA_PUNTOS,
+                 directorio_cache=DIRECTORIO_CACHE):
+        self.nodos_path = nodos_path
+        self.aristas_path = aristas_path
+        self.puntos_path = puntos_path
+        self.directorio_cache = directorio_cache
+        self._valores = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._precalentamiento = None
+        self.error_precalentamiento = None
+
+    def _memo(self, nombre, construir):
+        if nombre in self._valores:
+            return self._valores[nombre]
+        with self._locks_lock:
+            lock = self._locks.setdefault(nombre, threading.Lock())
+        with lock:
+            if nombre not in self._valores:
+                with trazas.tramo("carga", estructura=nombre):
+                    self._valores[nombre] = construir()
+        return self._valores[nombre]
+
+    def cargado(self, nombre):
+        return nombre in self._valores
+
+    @property
+    def clave(self):
+        # Hash de los CSV de la red: identifica las cachés en disco sin cargar el grafo.
+        def construir():
+            from grafo import hash_entradas
+            return hash_entradas(self.nodos_path, self.aristas_path)
+        return self._memo('clave', construir)
+
+    @property
+    def grafo(self):
+        def construir():
+            from grafo import cargar_grafo
+            return cargar_grafo(self.nodos_path, self.aristas_path, self.directorio_cache)
+        return self._memo('grafo', construir)
+
+    @property
+    def indice_espacial(self):
+        def construir():
+            from indice_espacial import IndiceEspacial
+            return IndiceEspacial(self.grafo)
+        return self._memo('indice_espacial', construir)
+
+    @property
+    def pos_nodos(self):
+        return self._memo('pos_nodos', lambda: self.grafo.pos_nodos())
+
+    @property
+    def grafos_networkx(self):
+        # Sólo los modos Dijkstra y A* originales necesitan los grafos de NetworkX.
+        return self._memo('grafos_networkx', lambda: self.grafo.a_networkx())
+
+    @property
+    def registros_puntos(self):
+        # Filas del CSV de puntos seguros (nombre, lat, lon...), sin enganchar a ninguna red.
+        def construir():
+            import pandas as pd
+            return pd.read_csv(self.puntos_path).to_dict('records')
+        return self._memo('registros_puntos', construir)
+
+    @property
+    def puntos_seguros(self):
+        # Lista de diccionarios (nombre, lat, lon, nodo...) enganchados una sola vez a la red.
+        def construir():
+            puntos = [dict(registro) for registro in self.registros_puntos]
+            lats, lons = [punto["lat"] for punto in puntos], [punto["lon"] for punto in puntos]
+            nodos = self.indice_espacial.nodos_cercanos(lats, lons)
+            for punto, nodo in zip(puntos, nodos):
+                punto["nodo"] = int(self.grafo.ids[nodo])
+            return puntos, nodos, self.indice_espacial.enganchar(lats, lons)
+        return self._memo('puntos_seguros', construir)[0]
+
+    @property
+    def nodos_seguros(self):
+        self.puntos_seguros
+        return self._valores['puntos_seguros'][1]
+
+    @property
+    def enganche_seguros(self):
+        self.puntos_seguros
+        return self._valores['puntos_seguros'][2]
+
+    @property
+    def objetivos_seguros(self):
+        # (costo final por nodo de entrada, punto seguro por nodo de entrada) para las búsquedas punto a punto.
+        def construir():
+            from rutas import objetivos_de_enganche
+            return objetivos_de_enganche(self.grafo.pesos, self.enganche_seguros)
+        return self._memo('objetivos_seguros', construir)
+
+    @property
+    def campo_evacuacion(self):
+        def construir():
+            from rutas import CampoEvacuacion
+            return CampoEvacuacion.desde_enganche(self.grafo, self.enganche_seguros)
+        return self._memo('campo_evacuacion', construir)
+
+    @property
+    def buscador_csr(self):
+        def construir():
+            from rutas import BuscadorCSR
+            return BuscadorCSR(self.grafo)
+        return self._memo('buscador_csr', construir)
+
+    @property
+    def heuristica_alt(self):
+        def construir():
+            from rutas import cargar_landmarks
+            return cargar_landmarks(self.grafo).para_objetivos(list(self.objetivos_seguros[0]))
+        return self._memo('heuristica_alt', construir)
+
+    @property
+    def grafo_particionado(self):
+        # Si las particiones ya están en disco se abren sin cargar el grafo ni el índice espacial.
+        def construir():
+            from particiones import cargar_particiones, directorio_particiones
+            return cargar_particiones(directorio_particiones(self.clave, self.directorio_cache), lambda: self.grafo)
+        return self._memo('grafo_particionado', construir)
+
+    @property
+    def objetivos_particionados(self):
+        # Como objetivos_seguros, pero con los puntos enganchados por celdas: (costos, puntos por nodo, enganche).
+        def construir():
+            from rutas import objetivos_de_enganche
+            registros = self.registros_puntos
+            enganche, pesos = self.grafo_particionado.enganchar([r["lat"] for r in registros], [r["lon"] for r in registros])
+            return objetivos_de_enganche(pesos, enganche) + (enganche,)
+        return self._memo('objetivos_particionados', construir)
+
+    @property
+    def limites(self):
+        # Capa de límites distritales; None si falta el GeoJSON, que no impide usar el resto.
+        def construir():
+            from limites import RUTA_GEOJSON, cargar_limites
+            import os
+            if not os.path.exists(RUTA_GEOJSON):
+                return None
+            return cargar_limites(RUTA_GEOJSON, self.directorio_cache)
+        return self._memo('limites', construir)
+
+    def precalentar(self, al_terminar=None):
+        # Construye en segundo plano lo que usa cualquier vista; las llamadas repetidas no hacen nada.
+        if self._precalentamiento is not None:
+            return self._precalentamiento
+
+        def tarea():
+            try:
+                self.grafo
+                self.indice_espacial
+                self.pos_nodos
+                self.puntos_seguros
+                self.campo_evacuacion
+            except Exception as e:
+                self.error_precalentamiento = e
+            try:
+                self.limites
+            except Exception:
+                # Un GeoJSON dañado no impide usar la red; cada vista lo avisa al cargar los límites.
+                pass
+            if al_terminar:
+                al_terminar()
+
+        self._precalentamiento = threading.Thread(target=tarea, daemon=True)
+        self._precalentamiento.start()
+        return self._precalentamiento
+
+
+def obtener_servicio(nodos_path=RUTA_NODOS, aristas_path=RUTA_ARISTAS, puntos_path=RUTA_PUNTOS,
+                     directorio_cache=DIRECTORIO_CACHE):
+    # Un único servicio por proceso y por conjunto de archivos.
+    clave = (nodos_path, aristas_path, puntos_path, directorio_cache)
+    with _servicios_lock:
+        if clave not in _servicios:
+            _servicios[clave] = ServicioDatos(*clave)
+        return _servicios[clave]
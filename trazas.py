@@ -0,0 +1,200 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# Trazas de tiempo anidadas. Desactivadas (por defecto) cada tramo cuesta una llamada que devuelve un objeto vacío.
+RUTA_LOG = "trazas.jsonl"
+TAMANO_MAXIMO_LOG = 5 * 2 ** 20
+COPIAS_LOG = 3
+HISTORIAL = 50
+FUNCIONES_PERFIL = 15
+
+_activo = False
+_perfil = False
+_logger = None
+_local = threading.local()
+_historial = deque(maxlen=HISTORIAL)
+_historial_lock = threading.Lock()
+
+
+class _Nulo:
+    # Sustituto de Tramo cuando las trazas están desactivadas.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def anotar(self, **atributos):
+        pass
+
+    def terminar(self, **atributos):
+        pass
+
+
+NULO = _Nulo()
+
+
+def _pila():
+    pila = getattr(_local, 'pila', None)
+    if pila is None:
+        pila = _local.pila = []
+    return pila
+
+
+class Tramo:
+    # Un intervalo con nombre, atributos, contadores y tramos hijos. Un tramo raíz puede activarse
+    # en varios hilos sucesivamente (búsqueda en el planificador, dibujo en Tk) y se cierra con terminar().
+    def __init__(self, nombre, atributos, raiz_manual=False):
+        self.nombre = nombre
+        self.atributos = atributos
+        self.contadores = {}
+        self.hijos = []
+        self.inicio = time.time()
+        self._reloj = time.perf_counter()
+        self.duracion = None
+        self._raiz_manual = raiz_manual
+        self._padre = None
+        self._perfilador = None
+        self._estadisticas = None
+
+    def anotar(self, **atributos):
+        self.atributos.update(atributos)
+
+    def __enter__(self):
+        pila = _pila()
+        if self._raiz_manual:
+            self._padre = None
+        else:
+            self._padre = pila[-1] if pila else None
+        if self._padre is None and _perfil:
+            self._perfilador = cProfile.Profile()
+            try:
+                self._perfilador.enable()
+            except ValueError:
+                # Ya hay otro perfilador activo en este hilo.
+                self._perfilador = None
+        pila.append(self)
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        pila = _pila()
+        if pila and pila[-1] is self:
+            pila.pop()
+        if self._perfilador is not None:
+            self._perfilador.disable()
+            if self._estadisticas is None:
+                self._estadisticas = pstats.Stats(self._perfilador)
+            else:
+                self._estadisticas.add(self._perfilador)
+            self._perfilador = None
+        if tipo is not None:
+            self.atributos.setdefault('error', f"{tipo.__name__}: {valor}")
+        if self._raiz_manual:
+            return False
+        self.duracion = time.perf_counter() - self._reloj
+        if self._padre is not None:
+            self._padre.hijos.append(self)
+        else:
+            _registrar(self)
+        return False
+
+    def terminar(self, **atributos):
+        self.atributos.update(atributos)
+        self.duracion = time.perf_counter() - self._reloj
+        _registrar(self)
+
+    def a_dict(self):
+        registro = {'nombre': self.nombre, 'duracion_ms': (self.duracion or 0.0) * 1000}
+        if self.atributos: registro['atributos'] = self.atributos
+        if self.contadores: registro['contadores'] = self.contadores
+        if self.hijos: registro['hijos'] = [hijo.a_dict() for hijo in self.hijos]
+        return registro
+
+
+def ruta_log(directorio):
+    # Log dentro del directorio de datos de la aplicación, en lugar del directorio actual.
+    return os.path.join(directorio, RUTA_LOG)
+
+
+def activar(log_path=RUTA_LOG, perfil=False):
+    # log_path=None sólo guarda el historial en memoria (para el panel de diagnóstico).
+    global _activo, _perfil, _logger
+    if log_path and _logger is None:
+        if os.path.dirname(log_path):
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        _logger = logging.getLogger("evacuacion.trazas")
+        _logger.propagate = False
+        _logger.setLevel(logging.INFO)
+        manejador = RotatingFileHandler(log_path, maxBytes=TAMANO_MAXIMO_LOG, backupCount=COPIAS_LOG, encoding="utf-8", delay=True)
+        manejador.setFormatter(logging.Formatter("%(message)s"))
+        _logger.addHandler(manejador)
+    _perfil = perfil
+    _activo = True
+
+
+def desactivar():
+    global _activo, _perfil
+    _activo = _perfil = False
+
+
+def activo():
+    return _activo
+
+
+def activar_desde_entorno(log_path=RUTA_LOG):
+    # EVACUACION_TRAZAS=1 activa las trazas; EVACUACION_TRAZAS=perfil también el perfilador.
+    valor = os.environ.get("EVACUACION_TRAZAS", "").lower()
+    if valor and valor not in ("0", "no", "false"):
+        activar(log_path, perfil=valor == "perfil")
+
+
+def tramo(nombre, **atributos):
+    # Tramo anidado en el tramo actual del hilo; si no hay ninguno, se registra al salir.
+    if not _activo:
+        return NULO
+    return Tramo(nombre, atributos)
+
+
+def iniciar(nombre, **atributos):
+    # Tramo raíz que se activa con `with` en uno o más hilos y se cierra explícitamente con terminar().
+    if not _activo:
+        return NULO
+    return Tramo(nombre, atributos, raiz_manual=True)
+
+
+def contar(**contadores):
+    if not _activo:
+        return
+    pila = _pila()
+    if pila:
+        actuales = pila[-1].contadores
+        for clave, valor in contadores.items():
+            actuales[clave] = actuales.get(clave, 0) + valor
+
+
+def _registrar(raiz):
+    registro = raiz.a_dict()
+    registro['inicio'] = raiz.inicio
+    registro['hilo'] = threading.current_thread().name
+    if raiz._estadisticas is not None:
+        salida = io.StringIO()
+        raiz._estadisticas.stream = salida
+        raiz._estadisticas.sort_stats('cumulative').print_stats(FUNCIONES_PERFIL)
+        registro['perfil'] = salida.getvalue()
+    with _historial_lock:
+        _historial.append(registro)
+    if _logger is not None:
+        _logger.info(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+def historial():
+    with _historial_lock:
+        return list(_historial)